@@ -0,0 +1,86 @@
+"""Compare per-ASIN scanning of the OptiSage payload with the pre-built eligibility index.
+
+Builds a synthetic OptiSage response (every ASIN answered, in shuffled order) and times
+resolving the status of every ASIN in the storefront, once with the old linear scan per
+ASIN and once through ``index_eligibility`` + ``eligibility_status``.
+
+    python benchmarks/bench_eligibility_parse.py [--sizes 30 1000 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def scan_eligibility_result(eligibility_data: dict, asin: str) -> dict:
+    """The pre-index parser: walks the whole ``data`` list for every ASIN."""
+    if not eligibility_data:
+        return {'status': '❓ API Error', 'reason': 'No eligibility data received'}
+    if 'data' in eligibility_data and isinstance(eligibility_data['data'], list):
+        for item in eligibility_data['data']:
+            if item.get('asin') == asin:
+                if item.get('isEligible', False):
+                    return {'status': '✅ Eligible', 'reason': 'Seller is eligible to sell this product'}
+                return {'status': '❌ Restricted', 'reason': 'Seller is not eligible to sell this product'}
+    return {'status': '⚠️ Not Found', 'reason': 'ASIN not found in eligibility results'}
+
+
+def payload(n_asins: int):
+    rng = random.Random(42)
+    asins = [f"B{i:09d}" for i in range(n_asins)]
+    data = [{'asin': a, 'isEligible': rng.random() < 0.5} for a in asins]
+    rng.shuffle(data)
+    return asins, {'success': True, 'data': data}
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(n_asins: int, repeat: int):
+    asins, data = payload(n_asins)
+
+    def scan():
+        return [scan_eligibility_result(data, a) for a in asins]
+
+    def indexed():
+        index, fallback = main.index_eligibility(data)
+        return [main.eligibility_status(index, fallback, a) for a in asins]
+
+    assert scan() == indexed()
+    # The quadratic scan gets slow quickly; one pass is plenty at the large sizes
+    scan_s = best_of(repeat if n_asins <= 1000 else 1, scan)
+    indexed_s = best_of(repeat, indexed)
+    return {
+        'asins': n_asins,
+        'scan_ms': round(scan_s * 1000, 3),
+        'indexed_ms': round(indexed_s * 1000, 3),
+        'speedup': round(scan_s / indexed_s, 1) if indexed_s else None,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        print(json.dumps(run(n, args.repeat)))
+
+
+if __name__ == "__main__":
+    main_cli()
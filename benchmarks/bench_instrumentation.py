@@ -0,0 +1,81 @@
+"""Overhead of the per-stage timing added to /analyze_seller.
+
+Replays the instrumentation of one uncached request (seven stages, four of them making an
+outbound call, then the Server-Timing header) with empty stage bodies, once with a
+RequestTimer in context and once without (the STAGE_TIMING=0 path), and times rendering
+/metrics after many label combinations have been recorded.
+
+    python benchmarks/bench_instrumentation.py [--iterations 20000]
+
+For an end-to-end check, compare ``bench_load.py --env STAGE_TIMING=0`` with a default run.
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+STAGES = [("asin_fetch", "keepa"), ("product_details", "keepa"), ("eligibility", "optisage"),
+          ("category_names", "keepa"), ("format", None), ("serialize", None)]
+
+
+class FakeResponse:
+    def __init__(self):
+        self.headers = {}
+
+
+def one_request(instrumented: bool, marketplace: str = "US", filtered: bool = False) -> None:
+    timer = main.RequestTimer(marketplace, filtered) if instrumented else None
+    main.request_timer.set(timer)
+    for name, target in STAGES:
+        with main.stage(name):
+            if target:
+                main.record_outbound(target)
+    if timer:
+        timer.finish(FakeResponse())
+
+
+def per_request_us(instrumented: bool, iterations: int) -> float:
+    def loop():
+        for _ in range(iterations):
+            one_request(instrumented)
+    ctx = contextvars.copy_context()
+    start = time.perf_counter()
+    ctx.run(loop)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    disabled = min(per_request_us(False, args.iterations) for _ in range(3))
+    enabled = min(per_request_us(True, args.iterations) for _ in range(3))
+
+    # Every marketplace x filter combination populated, as on a long-running worker
+    for marketplace in main.DOMAIN_MAP:
+        for filtered in (True, False):
+            contextvars.copy_context().run(one_request, True, marketplace, filtered)
+    start = time.perf_counter()
+    body = main.stage_metrics.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    print(json.dumps({
+        'per_request_us_disabled': round(disabled, 2),
+        'per_request_us_enabled': round(enabled, 2),
+        'overhead_us_per_request': round(enabled - disabled, 2),
+        'metrics_render_ms': round(render_ms, 3),
+        'metrics_series_lines': body.count("\n"),
+    }))
+
+
+if __name__ == "__main__":
+    main_cli()
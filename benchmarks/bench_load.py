@@ -0,0 +1,333 @@
+"""End-to-end load benchmark for /analyze_seller against local Keepa and OptiSage stand-ins.
+
+The stand-ins are a small aiohttp server that replays ``fixtures/storefront.json`` with
+configurable latency:
+
+- Keepa ``/query`` (product_finder), ``/product``, ``/category`` and ``/token``;
+- OptiSage ``/api/go-compare/seller-eligibility``.
+
+For each concurrency level, a fresh app process is started under uvicorn. Its Keepa
+traffic is pointed at the stand-ins and OPTISAGE_BASE_URL at the fake OptiSage route.
+Warm-up requests run first. Then ``--requests`` requests are driven with exactly
+``concurrency`` in flight. Each level reports:
+
+- p50/p95/p99 latency and requests per second;
+- outbound calls per request, by route;
+- the app's peak RSS (VmHWM).
+
+Results are printed as JSON, and also written to ``--output`` when given, so runs can be
+diffed. The fixture file holds a finder ASIN list, product objects as Keepa returns them,
+category objects and OptiSage answers. A recorded one can be dropped in with ``--fixtures``.
+``--make-fixtures`` writes a synthetic one.
+
+    python benchmarks/bench_load.py [--concurrency 1 8 32] [--requests 200]
+        [--keepa-latency 0.15] [--optisage-latency 0.4] [--env ANALYZE_MODE=sync] [--output run.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(HERE, "fixtures", "storefront.json")
+KEEPA_URL = "https://api.keepa.com"
+
+
+# --- Fixtures ---
+def make_fixtures(path: str, n_asins: int = 300) -> None:
+    sys.path.insert(0, HERE)
+    os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+    os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    from bench_product_query import make_product
+
+    rng = random.Random(7)
+    asins = [f"B0{i:08d}" for i in range(n_asins)]
+    products = {}
+    for asin in asins:
+        product = make_product(asin, rng, history=False)
+        product.update(rating=rng.randint(25, 50), reviewCount=rng.randint(0, 40000))
+        products[asin] = product
+    roots = sorted({p['rootCategory'] for p in products.values()})
+    fixtures = {
+        'finder': asins,
+        'products': products,
+        'categories': {str(c): {'catId': c, 'name': f"Root category {c}", 'parent': 0} for c in roots},
+        'eligibility': {asin: rng.random() < 0.6 for asin in asins},
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(fixtures, f, separators=(",", ":"))
+
+
+# --- Stand-in backends ---
+class FakeBackends:
+    """Keepa and OptiSage stand-ins on one local port, counting every call by route."""
+
+    def __init__(self, fixtures: dict, keepa_latency: float, optisage_latency: float, jitter: float):
+        self.fixtures = fixtures
+        self.keepa_latency = keepa_latency
+        self.optisage_latency = optisage_latency
+        self.jitter = jitter
+        self.calls = {}
+        self.port = None
+        self._loop = None
+        self._ready = threading.Event()
+
+    def _status(self) -> dict:
+        return {'tokensLeft': 1000000, 'refillIn': 1000, 'refillRate': 1000, 'timestamp': time.time() * 1000,
+                'tokensConsumed': 1}
+
+    async def _delay(self, latency: float) -> None:
+        if latency:
+            await asyncio.sleep(max(0.0, random.gauss(latency, latency * self.jitter)))
+
+    async def keepa(self, request: web.Request) -> web.Response:
+        route = request.match_info['route']
+        self.calls[f"keepa_{route}"] = self.calls.get(f"keepa_{route}", 0) + 1
+        await self._delay(self.keepa_latency)
+        q = request.query
+        body = self._status()
+        if route == "query":
+            selection = json.loads(q['selection'])
+            finder = self.fixtures['finder']
+            # Each seller gets its own rotation of the recorded storefront
+            shift = sum(map(ord, str(selection.get('sellerIds', '')))) % len(finder)
+            storefront = finder[shift:] + finder[:shift]
+            if selection.get('rootCategory'):
+                wanted = {int(c) for c in selection['rootCategory']}
+                storefront = [a for a in storefront if self.fixtures['products'][a]['rootCategory'] in wanted]
+            per_page, page = selection.get('perPage', 50), selection.get('page', 0)
+            body['asinList'] = storefront[page * per_page:(page + 1) * per_page]
+        elif route == "product":
+            products = self.fixtures['products']
+            body['products'] = [products[a] for a in q['asin'].split(",") if a in products]
+        elif route == "category":
+            categories = self.fixtures['categories']
+            ids = q['category'].split(",")
+            body['categories'] = dict(categories) if ids == ["0"] else {c: categories[c] for c in ids if c in categories}
+        return web.json_response(body)
+
+    async def optisage(self, request: web.Request) -> web.Response:
+        self.calls['optisage'] = self.calls.get('optisage', 0) + 1
+        await self._delay(self.optisage_latency)
+        payload = await request.json()
+        eligibility = self.fixtures['eligibility']
+        return web.json_response([{'asin': a, 'isEligible': eligibility.get(a, False)} for a in payload['asins']])
+
+    async def head(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="fake-backends", daemon=True).start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get("/{route}/", self.keepa)
+        app.router.add_post("/api/go-compare/seller-eligibility", self.optisage)
+        app.router.add_route("HEAD", "/", self.head)
+        runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def reset(self) -> dict:
+        calls, self.calls = self.calls, {}
+        return calls
+
+
+# --- App under test ---
+def serve_app(port: int, backend_url: str) -> None:
+    """Entry point of the app subprocess: route Keepa to the stand-ins, then run uvicorn."""
+    import warnings
+
+    import requests
+    import uvicorn
+
+    real_get = requests.get
+
+    def get(url, *args, **kwargs):
+        return real_get(url.replace(KEEPA_URL, backend_url), *args, **kwargs)
+
+    requests.get = get
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        class RoutedSession(aiohttp.ClientSession):
+            def _request(self, method, str_or_url, **kwargs):
+                return super()._request(method, str(str_or_url).replace(KEEPA_URL, backend_url), **kwargs)
+
+    import keepa.keepa_async
+    keepa.keepa_async.aiohttp = type(sys)("aiohttp_routed")
+    keepa.keepa_async.aiohttp.__dict__.update(aiohttp.__dict__, ClientSession=RoutedSession)
+
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def start_app(backend_url: str, env_overrides: dict, state_dir: str):
+    port = free_port()
+    env = {
+        **os.environ,
+        'KEEPA_API_KEY': "x" * 64,
+        'OPTISAGE_TOKEN': "benchmark",
+        'OPTISAGE_BASE_URL': backend_url,
+        'KEEPA_SCHEDULER_STATE': os.path.join(state_dir, "keepa-tokens.json"),
+        'CATEGORY_TREE_DIR': os.path.join(state_dir, "category-tree"),
+        # Measure the pipeline, not the response cache, unless asked otherwise
+        'RESPONSE_FRESH_SECONDS': "0",
+        'RESPONSE_STALE_SECONDS': "0",
+        **env_overrides,
+    }
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve-app", str(port), backend_url], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("app process exited during startup")
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("app did not start listening within 30 seconds")
+
+
+# --- Load driver ---
+async def drive(app_url: str, concurrency: int, n_requests: int, sellers: int, page_size: int):
+    latencies, errors = [], 0
+    counter = iter(range(n_requests))
+
+    async def worker(session):
+        nonlocal errors
+        for i in counter:
+            body = {'seller_id': f"BENCHSELLER{i % sellers:04d}", 'page_size': page_size}
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{app_url}/analyze_seller", json=body) as resp:
+                    await resp.read()
+                    ok = resp.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency), timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[i] * 1000, 2)
+
+
+def run_level(backends: FakeBackends, backend_url: str, args, concurrency: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as state_dir:
+        proc, app_url = start_app(backend_url, dict(e.split("=", 1) for e in args.env), state_dir)
+        try:
+            if args.warmup:
+                asyncio.run(drive(app_url, min(concurrency, args.warmup), args.warmup, args.sellers, args.page_size))
+            backends.reset()
+            latencies, errors, elapsed = asyncio.run(drive(app_url, concurrency, args.requests, args.sellers, args.page_size))
+            calls = backends.reset()
+            rss = peak_rss_mb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                       'p99': percentile(latencies, 99), 'max': percentile(latencies, 100)},
+        'outbound_per_request': {route: round(n / len(latencies), 3) for route, n in sorted(calls.items())},
+        'outbound_total_per_request': round(sum(calls.values()) / len(latencies), 3),
+        'peak_rss_mb': rss,
+    }
+
+
+def main_cli():
+    if len(sys.argv) == 4 and sys.argv[1] == "--serve-app":
+        serve_app(int(sys.argv[2]), sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--sellers", type=int, default=20, help="distinct seller IDs cycled through")
+    parser.add_argument("--page-size", type=int, default=30)
+    parser.add_argument("--keepa-latency", type=float, default=0.15, help="seconds per Keepa call")
+    parser.add_argument("--optisage-latency", type=float, default=0.4, help="seconds per OptiSage call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency standard deviation, as a fraction")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--make-fixtures", action="store_true", help="write synthetic fixtures to --fixtures and exit")
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    if args.make_fixtures:
+        make_fixtures(args.fixtures)
+        return
+
+    with open(args.fixtures) as f:
+        fixtures = json.load(f)
+    backends = FakeBackends(fixtures, args.keepa_latency, args.optisage_latency, args.jitter)
+    backends.start()
+    backend_url = f"http://127.0.0.1:{backends.port}"
+
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ("output", "make_fixtures")},
+        'started_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'results': [run_level(backends, backend_url, args, c) for c in args.concurrency],
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main_cli()
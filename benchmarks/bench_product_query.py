@@ -0,0 +1,119 @@
+"""Compare the lean and full Keepa product query modes.
+
+Replays a synthetic Keepa /product response (100 ASINs, ~2 years of price history)
+through ``query_products`` with the HTTP layer stubbed out, and reports payload
+bytes, parse time and peak traced memory per 100 ASINs for each mode.
+
+    python benchmarks/bench_product_query.py [--asins 100] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import keepa.keepa_sync  # noqa: E402
+import main  # noqa: E402
+
+HISTORY_SERIES = 12     # non-empty csv series per product
+HISTORY_POINTS = 600    # (keepa minute, value) pairs per series
+
+# Plain (time, value) series; the *_SHIPPING series are triples and are left empty
+HISTORY_INDICES = [ind for ind, key, _ in keepa.csv_indices if "SHIPPING" not in key][:HISTORY_SERIES]
+
+
+def make_product(asin: str, rng: random.Random, history: bool) -> dict:
+    current = [rng.randint(500, 5000) if i in (0, 1, 3) else -1 for i in range(35)]
+    product = {
+        'asin': asin,
+        'title': f"Synthetic product {asin}",
+        'brand': "Bench",
+        'rootCategory': rng.choice([172282, 1055398, 3760911]),
+        'imagesCSV': f"{asin}.jpg,{asin}-2.jpg",
+        'stats': {'current': current, 'avg': current, 'avg30': current, 'avg90': current,
+                  'min': [[7000000, v] if v > 0 else None for v in current],
+                  'max': [[7000000, v] if v > 0 else None for v in current]},
+        'csv': None,
+    }
+    if history:
+        csv = [None] * len(keepa.csv_indices)
+        for series in HISTORY_INDICES:
+            points = []
+            t = 6000000
+            for _ in range(HISTORY_POINTS):
+                t += rng.randint(60, 1440)
+                points += [t, rng.randint(500, 5000)]
+            csv[series] = points
+        product['csv'] = csv
+    return product
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body: bytes):
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def payloads(n_asins: int):
+    rng = random.Random(42)
+    asins = [f"B{i:09d}" for i in range(n_asins)]
+    status = {'tokensLeft': 10000, 'refillIn': 1000, 'refillRate': 20, 'timestamp': time.time() * 1000}
+    bodies = {}
+    for history in (True, False):
+        products = [make_product(a, rng, history) for a in asins]
+        bodies[history] = json.dumps({**status, 'products': products}).encode()
+    return asins, bodies
+
+
+def run(mode: str, asins, bodies, repeat: int):
+    def fake_get(url, params=None, **kwargs):
+        return FakeResponse(bodies[bool(int(params.get('history', 1)))])
+
+    keepa.keepa_sync.requests.get = fake_get
+    api = keepa.Keepa("x" * 64, logging_level="WARNING")
+    api.update_status()
+
+    sent = bodies[mode == "full"]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        main.parse_product_details(main.query_products(api, asins, "US", mode=mode))
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    main.parse_product_details(main.query_products(api, asins, "US", mode=mode))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_100 = 100 / len(asins)
+    return {
+        'mode': mode,
+        'payload_bytes_per_100': int(len(sent) * per_100),
+        'parse_ms_per_100': round(min(times) * 1000 * per_100, 2),
+        'peak_mem_kb_per_100': int(peak / 1024 * per_100),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--asins", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asins, bodies = payloads(args.asins)
+    for mode in ("full", "lean"):
+        print(json.dumps(run(mode, asins, bodies, args.repeat)))
+
+
+if __name__ == "__main__":
+    main_cli()
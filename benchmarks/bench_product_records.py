@@ -0,0 +1,91 @@
+"""Memory held per 10,000 parsed products: per-product dicts vs ``ProductRecord``.
+
+"dicts" replays the previous pipeline: one details dict per product kept in the product
+cache, plus the per-request copy that was annotated with ``category_name``, each carrying
+its pre-formatted rating, price and image strings. "records" is ``parse_product_details``
+as it is now: one slotted record shared by the cache and the request.
+
+    python benchmarks/bench_product_records.py [--products 10000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from bench_product_query import make_product  # noqa: E402
+
+
+def parse_product_dicts(products):
+    """The dict-per-product parser this benchmark compares against."""
+    details = []
+    for product in products:
+        current = product['stats']['current']
+        price_cents = next((current[i] for i in (0, 13, 7, 1) if current[i] > 0), 0)
+        price = price_cents / 100 if price_cents > 0 else None
+        rating = product.get('rating', 0) / 10.0
+        reviews = product.get('reviewCount', 0)
+        details.append({
+            'asin': product['asin'],
+            'title': product.get('title', 'N/A'),
+            'brand': product.get('brand', 'N/A'),
+            'category_id': product.get('rootCategory', 'N/A'),
+            'category_name': None,
+            'sales_rank': current[3] if current[3] > 0 else 0,
+            'rating_value': rating,
+            'review_count': reviews,
+            'rating_display': f"{rating:.1f}/5 ({reviews:,} reviews)",
+            'current_price': f"${price:.2f}" if price else 'N/A',
+            'image_url': f"https://m.media-amazon.com/images/I/{product['imagesCSV'].split(',')[0]}",
+        })
+    return details
+
+
+def dict_pipeline(products):
+    cached = parse_product_dicts(products)
+    copies = [dict(d) for d in cached]
+    for d in copies:
+        d['category_name'] = "Synthetic category"
+    return cached, copies
+
+
+def record_pipeline(products):
+    return main.parse_product_details(products)
+
+
+def retained_bytes(fn, products) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    held = fn(products)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return after - before
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    products = []
+    for i in range(args.products):
+        product = make_product(f"B{i:09d}", rng, history=False)
+        product.update(rating=rng.randint(10, 50), reviewCount=rng.randint(0, 50000))
+        products.append(product)
+
+    per_10k = 10000 / args.products
+    for name, fn in (("dicts", dict_pipeline), ("records", record_pipeline)):
+        held = retained_bytes(fn, products)
+        print(json.dumps({'layout': name, 'kb_per_10k_products': int(held / 1024 * per_10k)}))
+
+
+if __name__ == "__main__":
+    main_cli()
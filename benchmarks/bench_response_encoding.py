@@ -0,0 +1,78 @@
+"""Serialization time of an /analyze_seller response: FastAPI's default path vs FastJSONResponse.
+
+"default" is what a returned dict went through before: ``jsonable_encoder`` followed by
+``JSONResponse.render`` (stdlib json). "fast" is ``FastJSONResponse.render`` (orjson when
+installed). The two outputs are asserted byte-identical before timing.
+
+    python benchmarks/bench_response_encoding.py [--sizes 30 5000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import main  # noqa: E402
+
+
+def response(n_products: int) -> dict:
+    rng = random.Random(42)
+    records = [
+        main.ProductRecord(asin=f"B{i:09d}", title=f"Synthetic product {i} – “quoted” & ünïcode", brand="Bench",
+                           category_id=rng.choice([172282, 1055398]), sales_rank=rng.randint(1, 200000),
+                           rating=rng.randint(10, 50), review_count=rng.randint(0, 50000),
+                           price_cents=rng.randint(0, 9999), image=f"{i}.jpg")
+        for i in range(n_products)
+    ]
+    eligibility = {'success': True, 'data': [{'asin': r.asin, 'isEligible': rng.random() < 0.5} for r in records]}
+    req = main.SellerRequest(seller_id="SBENCH")
+    return main._format_response(req, "US", records, eligibility, {172282: "Electronics", 1055398: "Home & Kitchen"})
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(n_products: int, repeat: int):
+    content = response(n_products)
+    default = JSONResponse(jsonable_encoder(content)).body
+    fast = main.FastJSONResponse(content).body
+    assert default == fast, "encoders disagree"
+
+    default_s = best_of(repeat, lambda: JSONResponse(jsonable_encoder(content)))
+    fast_s = best_of(repeat, lambda: main.FastJSONResponse(content))
+    return {
+        'products': n_products,
+        'bytes': len(fast),
+        'encoder': 'orjson' if main.orjson else 'json',
+        'default_ms': round(default_s * 1000, 3),
+        'fast_ms': round(fast_s * 1000, 3),
+        'speedup': round(default_s / fast_s, 1),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        print(json.dumps(run(n, args.repeat)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,11 +1,54 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+import aiohttp
+import asyncio
+import base64
+import bisect
+import contextvars
+import hashlib
+import json
+import math
+import mmap
 import keepa
 import requests
 import os
+import queue
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv  # Optional: for local development
 
+try:
+    import fcntl  # Cross-worker locking for the Keepa token scheduler (POSIX only)
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson  # Optional: faster encoding of the large JSON responses
+except ImportError:
+    orjson = None
+
+try:
+    # Optional: request tracing (opentelemetry-api + opentelemetry-sdk)
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+    trace = None
+
 # Load environment variables (for local development)
 load_dotenv()
 
@@ -25,7 +68,138 @@ if not KEEPA_API_KEY:
 if not OPTISAGE_TOKEN:
     raise RuntimeError("OPTISAGE_TOKEN environment variable is required")
 
-MAX_PRODUCTS = 30
+MAX_PRODUCTS = 30  # default page size of /analyze_seller
+MAX_PAGE_SIZE = 1000
+
+# Keepa product_finder page size (Keepa's minimum perPage is 50). Pages of /analyze_seller are
+# cut from these, so a cursor can point anywhere inside a Keepa page.
+KEEPA_FINDER_PAGE = int(os.getenv("KEEPA_FINDER_PAGE", "100"))
+
+# /analyze_seller/stream: the first chunk is small to get a record out quickly, later chunks
+# are larger to amortize the Keepa and OptiSage round trips
+STREAM_FIRST_CHUNK = int(os.getenv("STREAM_FIRST_CHUNK", "10"))
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "50"))
+STREAM_MAX_PRODUCTS = int(os.getenv("STREAM_MAX_PRODUCTS", "10000"))
+
+MAX_BATCH_SELLERS = int(os.getenv("MAX_BATCH_SELLERS", "50"))
+
+# "async" runs /analyze_seller on the event loop (AsyncKeepa + aiohttp); "sync" keeps the
+# original blocking pipeline in the threadpool so both can be benchmarked side by side
+ANALYZE_MODE = os.getenv("ANALYZE_MODE", "async").lower()
+if ANALYZE_MODE not in ("async", "sync"):
+    raise RuntimeError("ANALYZE_MODE must be 'async' or 'sync'")
+
+# Overall time budget of one /analyze_seller or /analyze_sellers call; callers may ask for less with
+# an X-Request-Timeout header (seconds). Every Keepa and OptiSage call only gets what is left of it,
+# and once it runs out the remaining stages are skipped and a partial response is returned.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+OPTISAGE_BASE_URL = os.getenv("OPTISAGE_BASE_URL", "https://api-staging.optisage.ai")
+OPTISAGE_TIMEOUT = float(os.getenv("OPTISAGE_TIMEOUT", "30"))
+
+# OptiSage keep-alive pool: total connections (the async connector's limit), connections per host,
+# idle seconds before a pooled connection is dropped, and how many TLS connections to open at
+# startup. The sync pool only talks to one host, so OPTISAGE_MAX_PER_HOST is its cap: calls
+# beyond it wait for a free connection instead of opening (and discarding) extra ones.
+OPTISAGE_POOL_SIZE = int(os.getenv("OPTISAGE_POOL_SIZE", "20"))
+OPTISAGE_MAX_PER_HOST = int(os.getenv("OPTISAGE_MAX_PER_HOST", "10"))
+OPTISAGE_KEEPALIVE_TIMEOUT = float(os.getenv("OPTISAGE_KEEPALIVE_TIMEOUT", "60"))
+OPTISAGE_PREWARM = int(os.getenv("OPTISAGE_PREWARM", "2"))
+
+# Eligibility checks are split into chunks of ASINs sent in parallel, at most
+# OPTISAGE_CHUNK_CONCURRENCY at a time per check. The chunk size starts at OPTISAGE_CHUNK_SIZE and
+# adapts between the MIN/MAX bounds: it grows while chunks answer within OPTISAGE_CHUNK_TARGET
+# seconds, shrinks in proportion when they are slower and halves on timeouts and 5xx errors.
+OPTISAGE_CHUNK_SIZE = int(os.getenv("OPTISAGE_CHUNK_SIZE", "50"))
+OPTISAGE_CHUNK_MIN = int(os.getenv("OPTISAGE_CHUNK_MIN", "10"))
+OPTISAGE_CHUNK_MAX = int(os.getenv("OPTISAGE_CHUNK_MAX", "200"))
+OPTISAGE_CHUNK_TARGET = float(os.getenv("OPTISAGE_CHUNK_TARGET", "2"))
+OPTISAGE_CHUNK_CONCURRENCY = int(os.getenv("OPTISAGE_CHUNK_CONCURRENCY", "4"))
+
+# Circuit breaker: after OPTISAGE_BREAKER_FAILURES consecutive timeouts, 429s or 5xx answers,
+# eligibility checks fail fast (products come back "Unavailable") for OPTISAGE_BREAKER_COOLDOWN
+# seconds, then a single probe call decides whether it closes again. 0 disables the breaker.
+OPTISAGE_BREAKER_FAILURES = int(os.getenv("OPTISAGE_BREAKER_FAILURES", "5"))
+OPTISAGE_BREAKER_COOLDOWN = float(os.getenv("OPTISAGE_BREAKER_COOLDOWN", "30"))
+
+# Hedged requests (off by default): a call still unanswered after the p95 latency of the last
+# OPTISAGE_HEDGE_WINDOW successful calls gets one duplicate, and the first success wins
+OPTISAGE_HEDGE = os.getenv("OPTISAGE_HEDGE", "0") == "1"
+OPTISAGE_HEDGE_WINDOW = int(os.getenv("OPTISAGE_HEDGE_WINDOW", "200"))
+OPTISAGE_HEDGE_MIN_SAMPLES = int(os.getenv("OPTISAGE_HEDGE_MIN_SAMPLES", "20"))
+
+# Threads used by the sync pipeline to overlap independent stages (e.g. OptiSage vs category names)
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "8"))
+
+# Keepa client pool: clients are created lazily up to this size and reused for the process lifetime
+KEEPA_POOL_SIZE = int(os.getenv("KEEPA_POOL_SIZE", "4"))
+KEEPA_TIMEOUT = float(os.getenv("KEEPA_TIMEOUT", "10"))
+
+# Keepa token scheduler: every Keepa call reserves its estimated cost from a token bucket shared
+# by all gunicorn workers through a locked state file. Calls queue for refills, but never longer
+# than KEEPA_MAX_WAIT or the request deadline; past that the API answers 429 with Retry-After.
+KEEPA_SCHEDULER_STATE = os.getenv("KEEPA_SCHEDULER_STATE")
+KEEPA_MAX_WAIT = float(os.getenv("KEEPA_MAX_WAIT", "20"))
+KEEPA_FINDER_COST = 10  # plus one token per 100 ASINs requested
+KEEPA_CATEGORY_COST = 1
+KEEPA_HTTP_STATUS = {message: int(code) for code, message in keepa.SCODES.items()}
+
+# Category names are near-static, so they are cached for a day by default
+CATEGORY_CACHE_SIZE = int(os.getenv("CATEGORY_CACHE_SIZE", "5000"))
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", str(24 * 3600)))
+KEEPA_CATEGORY_BATCH = 10  # Keepa accepts up to 10 category IDs per lookup
+
+# Parsed product details per (domain, ASIN); Keepa charges one token per product queried
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "50000"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", str(30 * 60)))
+KEEPA_TOKENS_PER_PRODUCT = 1
+KEEPA_QUERY_CHUNK = 100  # ASINs per /product request, the same batches the library would send
+
+# "lean" asks Keepa for stats only (no price history, offers or CSV/numpy decoding) and parses
+# the raw JSON straight into detail dicts; "full" keeps the library's default parsing
+KEEPA_PRODUCT_MODE = os.getenv("KEEPA_PRODUCT_MODE", "lean").lower()
+if KEEPA_PRODUCT_MODE not in ("lean", "full"):
+    raise RuntimeError("KEEPA_PRODUCT_MODE must be 'lean' or 'full'")
+
+# /analyze_seller results per normalized request: served as-is while younger than
+# RESPONSE_FRESH_SECONDS, then for RESPONSE_STALE_SECONDS more while one background refresh
+# per request replaces them. Both 0 disables the response cache.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_FRESH_SECONDS = float(os.getenv("RESPONSE_FRESH_SECONDS", "60"))
+RESPONSE_STALE_SECONDS = float(os.getenv("RESPONSE_STALE_SECONDS", "600"))
+
+# Optional on-disk tier under the product, category and finder caches: one SQLite file (WAL mode)
+# shared by every gunicorn worker on the host and surviving restarts and deploys. Unset = disabled.
+DISK_CACHE_PATH = os.getenv("DISK_CACHE_PATH")
+DISK_CACHE_MAX_ROWS = int(os.getenv("DISK_CACHE_MAX_ROWS", "1000000"))
+DISK_CACHE_PRUNE_EVERY = int(os.getenv("DISK_CACHE_PRUNE_EVERY", "1000"))  # rows written between prunes
+DISK_CACHE_BUSY_TIMEOUT = float(os.getenv("DISK_CACHE_BUSY_TIMEOUT", "0.2"))
+FINDER_CACHE_TTL = float(os.getenv("FINDER_CACHE_TTL", str(15 * 60)))
+
+# Root-category names per marketplace, kept in read-only memory-mapped files that every worker
+# maps. A background job refreshes files older than CATEGORY_TREE_MAX_AGE (0 disables the job);
+# workers notice a swapped-in file within CATEGORY_TREE_CHECK seconds.
+CATEGORY_TREE_DIR = os.getenv("CATEGORY_TREE_DIR", os.path.join(tempfile.gettempdir(), "keepa-category-tree"))
+CATEGORY_TREE_MAX_AGE = float(os.getenv("CATEGORY_TREE_MAX_AGE", str(7 * 24 * 3600)))
+CATEGORY_TREE_CHECK = float(os.getenv("CATEGORY_TREE_CHECK", "60"))
+
+# Eligibility answers per (seller, marketplace, ASIN). Restrictions can be lifted by an
+# ungating approval, so they expire sooner than eligible answers. Errors are never cached.
+ELIGIBILITY_CACHE_SIZE = int(os.getenv("ELIGIBILITY_CACHE_SIZE", "100000"))
+ELIGIBLE_TTL = float(os.getenv("ELIGIBLE_TTL", str(12 * 3600)))
+RESTRICTED_TTL = float(os.getenv("RESTRICTED_TTL", str(3600)))
+
+# Per-stage timing of /analyze_seller, reported in a Server-Timing header and as histograms on /metrics
+STAGE_TIMING = os.getenv("STAGE_TIMING", "1") != "0"
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Optional OpenTelemetry tracing: one root span per request plus a child span per Keepa and
+# OptiSage call. TRACING_EXPORTER is "" (off), "stdout" or "file" (TRACING_FILE, one JSON span per
+# line). Head sampling keeps TRACING_SAMPLE_RATIO of new traces; an incoming W3C traceparent's
+# sampling decision is honoured.
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.01"))
 
 # Marketplace domain mapping
 DOMAIN_MAP = {
@@ -51,17 +225,403 @@ class SellerRequest(BaseModel):
     seller_id: str = Field(..., description="The Amazon Seller ID (e.g., A3I41TQZK5ELJT).")
     marketplace: str = Field("US", description="The Amazon marketplace domain (e.g., US, UK, DE).")
     category_id: Optional[int] = Field(None, description="Optional: A specific Keepa Category ID to restrict the search (e.g., 3760911).")
+    page_size: int = Field(MAX_PRODUCTS, ge=1, le=MAX_PAGE_SIZE, description="Number of storefront ASINs per page.")
+    cursor: Optional[str] = Field(None, description="Optional: Next_Cursor from a previous response to fetch the following page.")
+    fresh: bool = Field(False, description="Optional: bypass the response cache and wait for live Keepa and OptiSage data.")
+
+class SellerBatchRequest(BaseModel):
+    sellers: List[SellerRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SELLERS, description="Sellers to analyze in one batch.")
+
+# --- Stage timing & metrics ---
+class StageMetrics:
+    """Process-wide stage latency histograms and outbound call counters in Prometheus text format."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (stage, marketplace, filtered) -> [bucket counts..., above last bucket, sum, count]
+        self._outbound = {}    # (stage, target, marketplace, filtered) -> calls
+
+    def observe(self, labels: tuple, seconds: float) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._histograms.get(labels)
+            if h is None:
+                h = self._histograms[labels] = [0] * (len(self.buckets) + 3)
+            h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def count_outbound(self, labels: tuple) -> None:
+        with self._lock:
+            self._outbound[labels] = self._outbound.get(labels, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            outbound = dict(self._outbound)
+        lines = ["# HELP storefront_stage_duration_seconds Time spent in each /analyze_seller stage.",
+                 "# TYPE storefront_stage_duration_seconds histogram"]
+        for (stage, marketplace, filtered), h in sorted(histograms.items()):
+            labels = f'stage="{stage}",marketplace="{marketplace}",filtered="{filtered}"'
+            cumulative = 0
+            for le, n in zip(self.buckets, h):
+                cumulative += n
+                lines.append(f'storefront_stage_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'storefront_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {h[-1]}')
+            lines.append(f'storefront_stage_duration_seconds_sum{{{labels}}} {h[-2]:.6f}')
+            lines.append(f'storefront_stage_duration_seconds_count{{{labels}}} {h[-1]}')
+        lines += ["# HELP storefront_outbound_calls_total Keepa and OptiSage calls made by each stage.",
+                  "# TYPE storefront_outbound_calls_total counter"]
+        for (stage, target, marketplace, filtered), n in sorted(outbound.items()):
+            lines.append(f'storefront_outbound_calls_total{{stage="{stage}",target="{target}",'
+                         f'marketplace="{marketplace}",filtered="{filtered}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+stage_metrics = StageMetrics(STAGE_BUCKETS)
+
+class RequestTimer:
+    """Stage durations and outbound calls of one request, carried in the ``request_timer`` context."""
+    __slots__ = ('marketplace', 'filtered', 'durations', 'outbound', 'started')
+
+    def __init__(self, marketplace: str, filtered: bool):
+        self.started = time.perf_counter()
+        self.marketplace = marketplace
+        self.filtered = "true" if filtered else "false"
+        self.durations = {}
+        self.outbound = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        stage_metrics.observe((name, self.marketplace, self.filtered), seconds)
+
+    def server_timing(self) -> str:
+        entries = []
+        for name, seconds in self.durations.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name in self.outbound:
+                entry += f';desc="{self.outbound[name]} outbound"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+    def finish(self, response):
+        self.record("total", time.perf_counter() - self.started)
+        response.headers["Server-Timing"] = self.server_timing()
+        return response
+
+request_timer: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+def finish_request_timer(response):
+    """Record the request's total and add its Server-Timing header; no-op outside a timed request."""
+    timer = request_timer.get()
+    return timer.finish(response) if timer else response
+current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage ``name`` of the current request (no-op outside one)."""
+    timer = request_timer.get()
+    if timer is None:
+        yield
+        return
+    token = current_stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - started)
+        current_stage.reset(token)
+
+def timed(name: str, fn, *args):
+    with stage(name):
+        return fn(*args)
+
+async def timed_async(name: str, coro):
+    # Each coroutine handed to gather runs in its own task, so stages do not see each other
+    with stage(name):
+        return await coro
+
+def record_outbound(target: str) -> None:
+    timer = request_timer.get()
+    if timer is None:
+        return
+    name = current_stage.get() or "other"
+    timer.outbound[name] = timer.outbound.get(name, 0) + 1
+    stage_metrics.count_outbound((name, target, timer.marketplace, timer.filtered))
+
+# --- Tracing ---
+def _configure_tracing():
+    if not TRACING_EXPORTER:
+        return None, None
+    if trace is None:
+        raise RuntimeError("TRACING_EXPORTER requires the opentelemetry-sdk package")
+    if TRACING_EXPORTER not in ("stdout", "file"):
+        raise RuntimeError("TRACING_EXPORTER must be 'stdout' or 'file'")
+    out = sys.stdout if TRACING_EXPORTER == "stdout" else open(TRACING_FILE, "a", buffering=1)
+    exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    provider = TracerProvider(resource=Resource.create({"service.name": "storefront-analyzer"}),
+                              sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)))
+    # Spans are exported from a background thread, off the request path
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider, provider.get_tracer("storefront-analyzer")
+
+tracer_provider, tracer = _configure_tracing()
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict] = None):
+    """Child span of the current trace; yields None when tracing is off."""
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+def span_error(current, error: BaseException) -> None:
+    # For failures that are handled (and so never reach the span's own exception hook)
+    if current is not None:
+        current.record_exception(error)
+        current.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+
+def set_request_attributes(attributes: Dict) -> None:
+    if tracer is not None:
+        trace.get_current_span().set_attributes({k: v for k, v in attributes.items() if v is not None})
 
 # --- OptiSage helper ---
+def _optisage_overloaded(status: Optional[int]) -> bool:
+    # No answer at all (timeout, connection error), rate limited, or failing server-side
+    return status is None or status == 429 or status >= 500
+
+class AdaptiveChunkSize:
+    """Number of ASINs per OptiSage eligibility call, tuned from the latency and status of past calls."""
+
+    def __init__(self, initial: int = OPTISAGE_CHUNK_SIZE, minimum: int = OPTISAGE_CHUNK_MIN,
+                 maximum: int = OPTISAGE_CHUNK_MAX, target: float = OPTISAGE_CHUNK_TARGET):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.target = target
+        self.size = min(max(initial, self.minimum), self.maximum)
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.failures = 0
+        self.latency = 0.0
+
+    def split(self, asins: List[str]) -> List[List[str]]:
+        size = self.size
+        return [asins[i:i + size] for i in range(0, len(asins), size)]
+
+    def record(self, n_asins: int, seconds: float, status: Optional[int]) -> None:
+        """Feed back one call: ``status`` is its HTTP status, None when it timed out or failed to connect."""
+        with self._lock:
+            self.chunks += 1
+            self.latency = seconds if self.chunks == 1 else 0.8 * self.latency + 0.2 * seconds
+            if status != 200:
+                self.failures += 1
+            if _optisage_overloaded(status):
+                size = self.size // 2
+            elif status != 200:
+                # A rejected request (bad token, bad payload) says nothing about load
+                return
+            elif seconds > self.target:
+                size = min(self.size, int(n_asins * self.target / seconds))
+            elif n_asins >= self.size:
+                # Only full chunks answering in time are evidence that bigger ones would too
+                size = self.size + max(1, self.size // 4)
+            else:
+                return
+            self.size = min(max(size, self.minimum), self.maximum)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'chunk_size': self.size, 'chunks_sent': self.chunks, 'chunks_failed': self.failures,
+                    'chunk_latency_ms': round(self.latency * 1000, 1)}
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; once ``cooldown`` has passed one probe call is let through."""
+    STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+    def __init__(self, threshold: int = OPTISAGE_BREAKER_FAILURES, cooldown: float = OPTISAGE_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Restarting the clock means a probe that never reports back only blocks one cooldown
+                self.state, self.opened_at = 'half_open', time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.state, self.failures = 'closed', 0
+                return
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and 0 < self.threshold <= self.failures):
+                self.state, self.opened_at = 'open', time.monotonic()
+                self.trips += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'trips': self.trips, 'rejected': self.rejected}
+
 class OptiSageAPI:
-    def __init__(self, bearer_token: str):
+    """OptiSage client holding long-lived keep-alive sessions (one blocking, one asyncio)."""
+
+    def __init__(self, bearer_token: str, pool_size: int = OPTISAGE_POOL_SIZE,
+                 max_per_host: int = OPTISAGE_MAX_PER_HOST, keepalive_timeout: float = OPTISAGE_KEEPALIVE_TIMEOUT):
         self.bearer_token = bearer_token
-        self.base_url = "https://api-staging.optisage.ai"
+        self.base_url = OPTISAGE_BASE_URL
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._async_session = None
+        self._lock = threading.Lock()
+        self._last_used = 0.0
+        # Counters of sync pools that were already dropped for being idle too long
+        self._retired = {'opened': 0, 'requests': 0}
+        self._async_stats = {'opened': 0, 'reused': 0}
+        self.chunking = AdaptiveChunkSize()
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=OPTISAGE_HEDGE_WINDOW)  # seconds per successful call
+        self.hedges = {'sent': 0, 'won': 0}
+        # Chunks of one check run here so they never queue behind the stage pool that is waiting on them;
+        # hedged duplicates get a pool of their own so they never queue behind the primaries they race
+        self._executor = ThreadPoolExecutor(max_workers=max_per_host, thread_name_prefix="optisage")
+        self._hedge_executor = ThreadPoolExecutor(max_workers=max_per_host, thread_name_prefix="optisage-hedge")
 
-    def check_seller_eligibility(self, seller_id: str, asins: List[str], marketplace: str) -> Dict:
-        if not self.bearer_token:
-            return {'success': False, 'error': 'No OptiSage token provided'}
+    # --- sessions ---
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_per_host, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            elif time.monotonic() - self._last_used > self.keepalive_timeout:
+                # urllib3 never expires idle sockets itself; drop them before the server does
+                self._retire_pools()
+            self._last_used = time.monotonic()
+            return self._session
+
+    def _connection_pools(self):
+        if self._session is None:
+            return []
+        pools = []
+        for adapter in dict.fromkeys(self._session.adapters.values()):
+            manager = adapter.poolmanager
+            pools.extend(manager.pools[key] for key in manager.pools.keys())
+        return pools
+
+    def _retire_pools(self) -> None:
+        for pool in self._connection_pools():
+            self._retired['opened'] += pool.num_connections
+            self._retired['requests'] += pool.num_requests
+        for adapter in dict.fromkeys(self._session.adapters.values()):
+            adapter.poolmanager.clear()
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        if self._async_session is None or self._async_session.closed:
+            trace = aiohttp.TraceConfig()
 
+            async def on_create(session, ctx, params):
+                self._async_stats['opened'] += 1
+
+            async def on_reuse(session, ctx, params):
+                self._async_stats['reused'] += 1
+
+            trace.on_connection_create_end.append(on_create)
+            trace.on_connection_reuseconn.append(on_reuse)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.max_per_host,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._async_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace],
+                                                        timeout=aiohttp.ClientTimeout(total=OPTISAGE_TIMEOUT))
+        return self._async_session
+
+    def warm_up(self, connections: int) -> None:
+        """Open ``connections`` TLS connections up front so the first requests reuse them."""
+        session = self._get_session()
+        list(stage_executor.map(lambda _: self._ping(session), range(min(connections, self.max_per_host))))
+
+    def _ping(self, session: requests.Session) -> None:
+        try:
+            session.head(self.base_url, timeout=5).close()
+        except requests.RequestException:
+            pass
+
+    async def warm_up_async(self, connections: int) -> None:
+        session = self._get_async_session()
+
+        async def ping():
+            try:
+                async with session.head(self.base_url, timeout=aiohttp.ClientTimeout(total=5)):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+        await asyncio.gather(*(ping() for _ in range(min(connections, self.max_per_host))))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._retire_pools()
+                self._session.close()
+                self._session = None
+
+    async def close_async(self) -> None:
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pools = self._connection_pools()
+            opened = self._retired['opened'] + sum(p.num_connections for p in pools)
+            sent = self._retired['requests'] + sum(p.num_requests for p in pools)
+            idle = sum(1 for p in pools if p.pool is not None for conn in list(p.pool.queue) if conn is not None)
+        async_idle = 0
+        if self._async_session is not None and not self._async_session.closed:
+            # aiohttp has no public idle-connection count; read it from the connector
+            conns = getattr(self._async_session.connector, '_conns', {})
+            async_idle = sum(len(c) for c in conns.values())
+        return {
+            'sync': {'connections_opened': opened, 'connections_reused': max(sent - opened, 0), 'connections_idle': idle},
+            'async': {'connections_opened': self._async_stats['opened'], 'connections_reused': self._async_stats['reused'],
+                      'connections_idle': async_idle},
+            'chunking': self.chunking.stats(),
+            'breaker': self.breaker.stats(),
+            'hedging': {'enabled': OPTISAGE_HEDGE, **self.hedges},
+        }
+
+    def render_metrics(self) -> str:
+        breaker = self.breaker.stats()
+        metrics = [
+            ('optisage_breaker_state', 'gauge', 'OptiSage circuit breaker state (0 closed, 1 half-open, 2 open).',
+             CircuitBreaker.STATES[breaker['state']]),
+            ('optisage_breaker_trips_total', 'counter', 'Times the OptiSage circuit breaker opened.', breaker['trips']),
+            ('optisage_breaker_rejected_total', 'counter', 'Eligibility calls failed fast by the open breaker.',
+             breaker['rejected']),
+            ('optisage_hedges_total', 'counter', 'Duplicate OptiSage calls sent after the p95 latency passed.',
+             self.hedges['sent']),
+            ('optisage_hedge_wins_total', 'counter', 'Hedged calls answered first by the duplicate.', self.hedges['won']),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    # --- eligibility ---
+    def _build_request(self, seller_id: str, asins: List[str], marketplace: str):
         url = f"{self.base_url}/api/go-compare/seller-eligibility"
         headers = {
             "Accept": "application/json",
@@ -73,206 +633,2115 @@ class OptiSageAPI:
             "marketplace_id": MARKETPLACE_NUMERIC.get(marketplace, 1),
             "asins": asins
         }
+        return url, headers, payload
+
+    @staticmethod
+    def _span_attributes(seller_id: str, asins: List[str], marketplace: str, hedge: bool) -> Dict:
+        return {'seller.id': seller_id, 'seller.marketplace': marketplace, 'optisage.asin_count': len(asins),
+                'optisage.hedge': hedge, 'retry.count': int(hedge)}
+
+    @staticmethod
+    def _merge_chunks(chunks: List[List[str]], results: List[Dict]) -> Dict:
+        if len(results) == 1:
+            return results[0]
+        answered = [isinstance(r.get('data'), list) and r.get('success') for r in results]
+        if not any(answered):
+            return results[0]
+        data = []
+        for chunk, result, ok in zip(chunks, results, answered):
+            if ok:
+                data.extend(result['data'])
+            else:
+                # Only this chunk's ASINs become API errors; see index_eligibility
+                error = {'error': result.get('error', 'OptiSage API failed'), 'details': result.get('details', ''),
+                         'degraded': result.get('degraded', False), 'skipped': result.get('skipped', False)}
+                data.extend({'asin': asin, **error} for asin in chunk)
+        return {'success': True, 'data': data, 'failed_chunks': answered.count(False)}
+
+    def check_seller_eligibility(self, seller_id: str, asins: List[str], marketplace: str) -> Dict:
+        if not self.bearer_token:
+            return {'success': False, 'error': 'No OptiSage token provided'}
+
+        chunks = self.chunking.split(asins)
+        results, pending = [None] * len(chunks), {}
+        for i, chunk in enumerate(chunks):
+            if len(pending) >= OPTISAGE_CHUNK_CONCURRENCY:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+            future = self._start_chunk(seller_id, chunk, marketplace)
+            pending[future] = i
+        for future, i in pending.items():
+            results[i] = future.result()
+        return self._merge_chunks(chunks, results)
+
+    async def check_seller_eligibility_async(self, seller_id: str, asins: List[str], marketplace: str) -> Dict:
+        if not self.bearer_token:
+            return {'success': False, 'error': 'No OptiSage token provided'}
+
+        chunks = self.chunking.split(asins)
+        gate = asyncio.Semaphore(OPTISAGE_CHUNK_CONCURRENCY)
+
+        async def limited(chunk):
+            async with gate:
+                return await self._check_chunk_async(seller_id, chunk, marketplace)
+
+        return self._merge_chunks(chunks, await asyncio.gather(*(limited(chunk) for chunk in chunks)))
+
+    # --- resilience ---
+    BREAKER_OPEN = {'success': False, 'error': 'OptiSage unavailable', 'details': 'circuit breaker open', 'degraded': True}
+    DEADLINE_REACHED = {'success': False, 'error': 'Request deadline reached', 'details': '', 'skipped': True}
+
+    @classmethod
+    def _skip_chunk(cls) -> Dict:
+        skip_stage("eligibility")
+        return dict(cls.DEADLINE_REACHED)
+
+    def _observe(self, n_asins: int, seconds: float, status: Optional[int]) -> None:
+        self.chunking.record(n_asins, seconds, status)
+        self.breaker.record(not _optisage_overloaded(status))
+        if status == 200:
+            with self._lock:
+                self._latencies.append(seconds)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not OPTISAGE_HEDGE:
+            return None
+        with self._lock:
+            if len(self._latencies) < OPTISAGE_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95)]
+
+    def _count_hedge(self, outcome: str) -> None:
+        with self._lock:
+            self.hedges[outcome] += 1
+
+    def _start_chunk(self, seller_id: str, asins: List[str], marketplace: str) -> Future:
+        """Check one chunk; the future resolves with the first successful attempt.
+
+        The primary attempt runs inline in its ``_executor`` thread. Only once it has been in
+        flight for the hedge delay does a duplicate go out from ``_hedge_executor``, so hedges
+        never queue behind primaries and the delay leaves out the primary's time in the queue.
+        """
+        outcome, lock, primary_done = Future(), threading.Lock(), threading.Event()
+        results, hedge_state = {}, []  # hedge_state gets 'sent' or 'skipped' once decided
+
+        def resolve(result: Dict) -> None:
+            if not outcome.done():
+                outcome.set_result(result)
+
+        def guarded(fn, *args) -> None:
+            try:
+                fn(*args)
+            except BaseException as e:
+                with lock:
+                    if not outcome.done():
+                        outcome.set_exception(e)
 
+        def primary() -> None:
+            left = time_left()
+            if left is not None and left <= 0:
+                return resolve(self._skip_chunk())
+            if not self.breaker.allow():
+                return resolve(dict(self.BREAKER_OPEN))
+            delay = self._hedge_delay()
+            if delay is not None:
+                self._hedge_executor.submit(contextvars.copy_context().run, guarded, hedge, delay)
+            try:
+                result = self._attempt(seller_id, asins, marketplace)
+            finally:
+                primary_done.set()
+            with lock:
+                if not hedge_state:
+                    hedge_state.append('skipped')
+                results['primary'] = result
+                # A failed primary still waits for a hedge in flight
+                if result['success'] or hedge_state[0] == 'skipped' or 'hedge' in results:
+                    resolve(result)
+
+        def hedge(delay: float) -> None:
+            if primary_done.wait(delay):
+                return
+            with lock:
+                if hedge_state:
+                    return
+                hedge_state.append('sent')
+            self._count_hedge('sent')
+            result = self._attempt(seller_id, asins, marketplace, True)
+            with lock:
+                results['hedge'] = result
+                if result['success'] and not outcome.done():
+                    self._count_hedge('won')
+                if result['success'] or 'primary' in results:
+                    resolve(result)
+
+        self._executor.submit(contextvars.copy_context().run, guarded, primary)
+        return outcome
+
+    async def _check_chunk_async(self, seller_id: str, asins: List[str], marketplace: str) -> Dict:
+        left = time_left()
+        if left is not None and left <= 0:
+            return self._skip_chunk()
+        if not self.breaker.allow():
+            return dict(self.BREAKER_OPEN)
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._attempt_async(seller_id, asins, marketplace)
+
+        first = asyncio.ensure_future(self._attempt_async(seller_id, asins, marketplace))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        self._count_hedge('sent')
+        hedge = asyncio.ensure_future(self._attempt_async(seller_id, asins, marketplace, True))
+        pending = {first, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result['success']:
+                        if task is hedge:
+                            self._count_hedge('won')
+                        return result
+            return result
+        finally:
+            # The slower attempt is abandoned; cancelled attempts are not fed back to the breaker
+            for task in pending:
+                task.cancel()
+
+    def _attempt(self, seller_id: str, asins: List[str], marketplace: str, hedge: bool = False) -> Dict:
+        try:
+            timeout = budget(OPTISAGE_TIMEOUT)
+        except DeadlineExceeded:
+            return self._skip_chunk()
+        url, headers, payload = self._build_request(seller_id, asins, marketplace)
+        record_outbound("optisage")
+        status, started = None, time.perf_counter()
+
+        with span("optisage.seller_eligibility", self._span_attributes(seller_id, asins, marketplace, hedge)) as current:
+            try:
+                resp = self._get_session().post(url, headers=headers, json=payload, timeout=timeout)
+                status = resp.status_code
+                if current is not None:
+                    current.set_attribute('http.status_code', status)
+                if status == 200:
+                    result = {'success': True, 'data': resp.json()}
+                else:
+                    result = {'success': False, 'error': f"API Error {status}", 'details': resp.text}
+            except ValueError as e:
+                # A 200 that isn't JSON (an error page from a proxy) counts as a failed call
+                span_error(current, e)
+                status, result = None, {'success': False, 'error': 'Invalid JSON from OptiSage', 'details': str(e)}
+            except requests.RequestException as e:
+                span_error(current, e)
+                if isinstance(e, requests.Timeout) and timeout < OPTISAGE_TIMEOUT:
+                    # Cut short by the request deadline, which says nothing about OptiSage's health
+                    return self._skip_chunk()
+                result = {'success': False, 'error': f"Request failed: {str(e)}"}
+        self._observe(len(asins), time.perf_counter() - started, status)
+        return result
+
+    async def _attempt_async(self, seller_id: str, asins: List[str], marketplace: str, hedge: bool = False) -> Dict:
+        try:
+            timeout = budget(OPTISAGE_TIMEOUT)
+        except DeadlineExceeded:
+            return self._skip_chunk()
+        url, headers, payload = self._build_request(seller_id, asins, marketplace)
+        record_outbound("optisage")
+        status, started = None, time.perf_counter()
+
+        with span("optisage.seller_eligibility", self._span_attributes(seller_id, asins, marketplace, hedge)) as current:
+            try:
+                async with self._get_async_session().post(url, headers=headers, json=payload,
+                                                          timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    status = resp.status
+                    if current is not None:
+                        current.set_attribute('http.status_code', status)
+                    if status == 200:
+                        result = {'success': True, 'data': await resp.json(content_type=None)}
+                    else:
+                        result = {'success': False, 'error': f"API Error {status}", 'details': await resp.text()}
+            except ValueError as e:
+                span_error(current, e)
+                status, result = None, {'success': False, 'error': 'Invalid JSON from OptiSage', 'details': str(e)}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                span_error(current, e)
+                if isinstance(e, asyncio.TimeoutError) and timeout < OPTISAGE_TIMEOUT:
+                    return self._skip_chunk()
+                result = {'success': False, 'error': f"Request failed: {str(e)}"}
+        self._observe(len(asins), time.perf_counter() - started, status)
+        return result
+
+# --- In-memory cache ---
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                    self.evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+category_cache = TTLCache(CATEGORY_CACHE_SIZE, CATEGORY_CACHE_TTL)
+eligibility_cache = TTLCache(ELIGIBILITY_CACHE_SIZE, ELIGIBLE_TTL)
+product_cache = TTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_FRESH_SECONDS + RESPONSE_STALE_SECONDS)
+
+# --- On-disk cache tier ---
+class DiskCache:
+    """SQLite-backed key/value cache shared by all worker processes on a host.
+
+    Rows live in one table keyed by ``(namespace, key)`` with JSON values and a wall-clock
+    expiry. WAL mode lets readers run alongside a writer from any process. Every
+    ``prune_every`` written rows, the writing process drops expired rows and trims the
+    table to ``max_rows``, evicting the rows closest to expiry first. Connections are
+    opened lazily per thread (and per process, so forked workers never share one), which
+    means startup only attaches to the file. With no ``path`` every call is a miss, and
+    SQLite errors are counted and treated as misses so the cache can never fail a request.
+    The ``*_async`` variants run the same queries on the thread pool so a slow disk or a
+    busy writer lock never stalls the event loop.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache (ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+        " expires_at REAL NOT NULL, PRIMARY KEY (ns, key))",
+        "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)",
+    )
+    BATCH = 500  # keys per statement, below SQLite's bound-parameter limit
+
+    def __init__(self, path: Optional[str], max_rows: int, prune_every: int, busy_timeout: float):
+        self.path = path
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._unpruned = 0
+        self.hits = 0
+        self.hits_by_ns: Dict[str, int] = {}
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, ns: str, keys: List[str]) -> Dict[str, tuple]:
+        """Return ``{key: (value, seconds_left)}`` for the keys that are present and fresh."""
+        if not self.path or not keys:
+            return {}
+        found = {}
+        now = time.time()
+        try:
+            conn = self._conn()
+            for i in range(0, len(keys), self.BATCH):
+                batch = keys[i:i + self.BATCH]
+                rows = conn.execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE ns = ? AND key IN ({','.join('?' * len(batch))})"
+                    " AND expires_at > ?", (ns, *batch, now)).fetchall()
+                for key, value, expires_at in rows:
+                    found[key] = (json.loads(value), expires_at - now)
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return {}
+        with self._lock:
+            self.hits += len(found)
+            self.hits_by_ns[ns] = self.hits_by_ns.get(ns, 0) + len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    async def get_many_async(self, ns: str, keys: List[str]) -> Dict[str, tuple]:
+        if not self.path or not keys:
+            return {}
+        return await run_in_threadpool(self.get_many, ns, keys)
+
+    def set_many(self, ns: str, items: Dict[str, object], ttl: float) -> None:
+        if not self.path or not items:
+            return
+        expires_at = time.time() + ttl
+        rows = [(ns, key, json.dumps(value), expires_at) for key, value in items.items()]
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.writes += len(rows)
+            self._unpruned += len(rows)
+            prune = self._unpruned >= self.prune_every
+            if prune:
+                self._unpruned = 0
+        if prune:
+            self.prune()
+
+    async def set_many_async(self, ns: str, items: Dict[str, object], ttl: float) -> None:
+        # set_many prunes inline, so the prune runs on the same worker thread
+        if self.path and items:
+            await run_in_threadpool(self.set_many, ns, items, ttl)
+
+    def prune(self) -> None:
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=30)
-            if resp.status_code == 200:
-                return {'success': True, 'data': resp.json()}
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                removed = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+                excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_rows
+                if excess > 0:
+                    removed += conn.execute(
+                        "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY expires_at LIMIT ?)",
+                        (excess,)).rowcount
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.evictions += removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': bool(self.path),
+                'max_rows': self.max_rows,
+                'hits': self.hits,
+                'hits_by_namespace': dict(self.hits_by_ns),
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+disk_cache = DiskCache(DISK_CACHE_PATH, DISK_CACHE_MAX_ROWS, DISK_CACHE_PRUNE_EVERY, DISK_CACHE_BUSY_TIMEOUT)
+
+# --- Shared category tree ---
+class CategoryTree:
+    """Root-category names per marketplace, one memory-mapped file each, shared by all workers.
+
+    File layout (little endian): a 16-byte header (magic, build time, count), the sorted
+    category IDs as uint64, ``count + 1`` uint32 offsets into the name blob, then the UTF-8
+    names. Lookups binary-search the mapped ID array in place, so nothing is copied into the
+    worker. Files are replaced atomically (write, fsync, rename); a worker keeps reading its
+    old mapping until its next check sees the new inode and remaps.
+    """
+
+    MAGIC = b"KCT1"
+    HEADER = struct.Struct("<4sdI")
+
+    def __init__(self, directory: str, check_interval: float):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._maps = {}      # domain -> (inode, built_at, ids, offsets, names)
+        self._checked = {}   # domain -> monotonic time of the last stat()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.swaps = 0
+
+    def _path(self, domain: str) -> str:
+        return os.path.join(self.directory, f"categories-{domain}.bin")
+
+    def _map(self, domain: str):
+        try:
+            with open(self._path(domain), 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, built_at, count = self.HEADER.unpack_from(mm, 0)
+            ids_end = self.HEADER.size + 8 * count
+            offsets_end = ids_end + 4 * (count + 1)
+            if magic != self.MAGIC or len(mm) < offsets_end:
+                return None
+            view = memoryview(mm)
+            return inode, built_at, view[self.HEADER.size:ids_end].cast('Q'), view[ids_end:offsets_end].cast('I'), view[offsets_end:]
+        except struct.error:
+            return None
+
+    def _current(self, domain: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._maps.get(domain)
+            if now - self._checked.get(domain, float('-inf')) < self.check_interval:
+                return entry
+            self._checked[domain] = now
+        try:
+            inode = os.stat(self._path(domain)).st_ino
+        except OSError:
+            inode = None
+        if entry is not None and entry[0] == inode:
+            return entry
+        # Old mappings are dropped, not closed: lookups in other threads may still hold views
+        entry = self._map(domain) if inode is not None else None
+        with self._lock:
+            if entry is not None and self._maps.get(domain) is not None:
+                self.swaps += 1
+            self._maps[domain] = entry
+        return entry
+
+    def lookup(self, domain: str, category_id: int) -> Optional[str]:
+        entry = self._current(domain)
+        name = None
+        if entry is not None:
+            _, _, ids, offsets, names = entry
+            i = bisect.bisect_left(ids, category_id)
+            if i < len(ids) and ids[i] == category_id:
+                name = bytes(names[offsets[i]:offsets[i + 1]]).decode()
+        with self._lock:
+            if name is None:
+                self.misses += 1
             else:
-                return {'success': False, 'error': f"API Error {resp.status_code}", 'details': resp.text}
-        except requests.RequestException as e:
-            return {'success': False, 'error': f"Request failed: {str(e)}"}
+                self.hits += 1
+        return name
+
+    def age(self, domain: str) -> Optional[float]:
+        entry = self._current(domain)
+        return time.time() - entry[1] if entry is not None else None
+
+    def names(self, domain: str) -> Dict[int, str]:
+        entry = self._current(domain)
+        if entry is None:
+            return {}
+        _, _, ids, offsets, names = entry
+        return {ids[i]: bytes(names[offsets[i]:offsets[i + 1]]).decode() for i in range(len(ids))}
+
+    def write(self, domain: str, names: Dict[int, str]) -> None:
+        ids = sorted(names)
+        blobs = [names[cid].encode() for cid in ids]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        data = (self.HEADER.pack(self.MAGIC, time.time(), len(ids)) + struct.pack(f"<{len(ids)}Q", *ids)
+                + struct.pack(f"<{len(offsets)}I", *offsets) + b"".join(blobs))
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".categories-{domain}-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path(domain))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._lock:
+            self._checked.pop(domain, None)
+
+    def stats(self) -> Dict:
+        domains = {}
+        for domain in DOMAIN_MAP:
+            entry = self._current(domain)
+            domains[domain] = {'categories': len(entry[2]), 'age_seconds': int(time.time() - entry[1])} if entry else None
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'swaps': self.swaps, 'marketplaces': domains}
+
+category_tree = CategoryTree(CATEGORY_TREE_DIR, CATEGORY_TREE_CHECK)
+
+# --- Single-flight coalescing ---
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution.
+
+    While a call for a key is in flight, later callers with that key wait for its
+    result (or exception) instead of running their own. ``do`` is for threads,
+    ``do_async`` for coroutines; the two keep separate in-flight tables. The call runs
+    under its first caller's request deadline, so a joining caller waits no longer than
+    its own deadline (raising DeadlineExceeded), and runs the call again itself when the
+    first caller's deadline ran out but its own has time left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                    self.executions += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            left = time_left()
+            if not call['done'].wait(None if left is None else max(left, 0)):
+                raise DeadlineExceeded()
+            if isinstance(call['error'], DeadlineExceeded) and self._has_time_left():
+                continue
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    async def do_async(self, key, fn):
+        while True:
+            leader = key not in self._tasks
+            task = self.start_async(key, fn)
+            if leader:
+                return await asyncio.shield(task)
+            # asyncio.wait never cancels the shared task, on timeout or when this caller is cancelled
+            left = time_left()
+            done, _ = await asyncio.wait({task}, timeout=None if left is None else max(left, 0))
+            if not done:
+                raise DeadlineExceeded()
+            try:
+                return task.result()
+            except DeadlineExceeded:
+                if not self._has_time_left():
+                    raise
+
+    @staticmethod
+    def _has_time_left() -> bool:
+        left = time_left()
+        return left is None or left > 0
+
+    def start_async(self, key, fn) -> asyncio.Future:
+        """Start ``fn()`` for ``key`` unless it is already in flight; returns the shared task."""
+        task = self._tasks.get(key)
+        if task is None:
+            # The work runs in its own task so a disconnecting first caller does not cancel it for the rest
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._finish(key, t))
+            with self._lock:
+                self.executions += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+        return task
+
+    def _finish(self, key, task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when nobody was left waiting
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'executions': self.executions, 'coalesced': self.coalesced,
+                    'in_flight': len(self._calls) + len(self._tasks)}
+
+flights = {
+    'analyze_seller': SingleFlight(),
+    'product_finder': SingleFlight(),
+    'product_query': SingleFlight(),
+    'category_lookup': SingleFlight(),
+}
+
+stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+
+def submit_stage(fn, *args):
+    # Run in the caller's context so the request deadline follows the work into the thread
+    return stage_executor.submit(contextvars.copy_context().run, fn, *args)
+
+optisage = OptiSageAPI(OPTISAGE_TOKEN)
+
+# --- Request deadline ---
+# Monotonic deadline of the request being served; Keepa waits and every outbound call are capped by it
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Stages of the current /analyze_seller computation cut short by the deadline (None elsewhere)
+skipped_stages: ContextVar[Optional[List[str]]] = ContextVar("skipped_stages", default=None)
+PIPELINE_STAGES = ("asin_fetch", "product_details", "eligibility", "category_names")
+
+class DeadlineExceeded(Exception):
+    """Raised when the request deadline passes before or during an outbound call."""
+
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+def time_left() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def budget(timeout: float) -> float:
+    """``timeout`` capped by what is left of the request deadline; raises once nothing is left."""
+    left = time_left()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(timeout, left)
+
+def skip_stage(name: str, and_after: bool = False) -> None:
+    """Record that stage ``name`` (with ``and_after``, every later one too) was skipped for the deadline."""
+    skipped = skipped_stages.get()
+    if skipped is not None:
+        names = PIPELINE_STAGES[PIPELINE_STAGES.index(name):] if and_after else (name,)
+        skipped.extend(n for n in names if n not in skipped)
+
+# --- Keepa token scheduler ---
+
+class KeepaTokensExhausted(Exception):
+    """Raised when a Keepa call would have to wait for tokens beyond the request deadline."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Keepa token budget exhausted, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class KeepaTokenScheduler:
+    """Token bucket mirroring Keepa's budget, shared across processes via a locked JSON file.
+
+    Each call reserves its estimated cost before it is sent. When the bucket is short, the
+    reservation still goes through (driving the balance negative) and the caller sleeps until
+    the refill covers it, so later callers queue up behind it in arrival order. Keepa's own
+    ``tokensLeft`` replaces the estimate after every response. The state file is read and
+    written under a blocking ``flock``, so async callers go through the thread pool.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.rejections = 0
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = {'tokens': None, 'refill_rate': None, 'updated_at': None, 'queued': 0, 'queued_cost': 0}
+                state.update(json.loads(raw) if raw else {})
+                now = time.time()
+                if state['tokens'] is not None and state['refill_rate'] and state['updated_at']:
+                    # Keepa's bucket holds at most one hour of refills
+                    refilled = state['tokens'] + state['refill_rate'] * (now - state['updated_at']) / 60
+                    state['tokens'] = max(state['tokens'], min(refilled, state['refill_rate'] * 60))
+                state['updated_at'] = now
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _max_wait(self) -> float:
+        deadline = request_deadline.get()
+        if deadline is None:
+            return KEEPA_MAX_WAIT
+        return min(KEEPA_MAX_WAIT, deadline - time.monotonic())
+
+    def _wait_for(self, tokens: float, cost: float, refill_rate: float) -> float:
+        return max(cost - tokens, 0) / refill_rate * 60
+
+    def _reserve(self, cost: float) -> float:
+        if cost <= 0:
+            return 0.0
+        with self._state() as state:
+            if state['tokens'] is None or not state['refill_rate']:
+                # No status observed yet; let the call through and learn from its response
+                return 0.0
+            wait = self._wait_for(state['tokens'], cost, state['refill_rate'])
+            if wait > self._max_wait():
+                self.rejections += 1
+                raise KeepaTokensExhausted(wait)
+            state['tokens'] -= cost
+            if wait > 0:
+                state['queued'] += 1
+                state['queued_cost'] += cost
+            return wait
+
+    def _dequeue(self, cost: float, wait: float) -> None:
+        with self._state() as state:
+            state['queued'] = max(state['queued'] - 1, 0)
+            state['queued_cost'] = max(state['queued_cost'] - cost, 0)
+            self.waits += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def acquire(self, cost: float) -> None:
+        wait = self._reserve(cost)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._dequeue(cost, wait)
+
+    async def acquire_async(self, cost: float) -> None:
+        wait = await run_in_threadpool(self._reserve, cost)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                # A cancelled caller must still leave the queue, or its cost stays in the shared file
+                await run_in_threadpool(self._dequeue, cost, wait)
+
+    def observe(self, tokens_left: Optional[float], refill_rate: Optional[float]) -> None:
+        if tokens_left is None:
+            return
+        with self._state() as state:
+            # Calls still waiting for their turn have not been charged by Keepa yet
+            state['tokens'] = tokens_left - state['queued_cost']
+            if refill_rate:
+                state['refill_rate'] = refill_rate
+
+    def retry_after(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available; counts as a rejected call."""
+        with self._state() as state:
+            self.rejections += 1
+            if state['tokens'] is None or not state['refill_rate']:
+                return 60.0
+            return self._wait_for(state['tokens'], cost, state['refill_rate'])
+
+    def stats(self) -> Dict:
+        with self._state() as state:
+            shared = dict(state)
+        return {
+            'tokens_available': round(shared['tokens'], 1) if shared['tokens'] is not None else None,
+            'refill_rate': shared['refill_rate'],
+            'queue_depth': shared['queued'],
+            'queued_cost': shared['queued_cost'],
+            'waits': self.waits,
+            'wait_seconds_total': round(self.wait_seconds, 3),
+            'wait_seconds_max': round(self.max_wait_seconds, 3),
+            'rejections': self.rejections,
+        }
+
+def _scheduler_state_path(accesskey: str) -> str:
+    if KEEPA_SCHEDULER_STATE:
+        return KEEPA_SCHEDULER_STATE
+    digest = hashlib.sha256(accesskey.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"keepa-tokens-{digest}.json")
+
+# --- Keepa client pool ---
+class KeepaClientPool:
+    """Process-wide pool of Keepa clients sharing one view of the token status.
+
+    Building a ``keepa.Keepa`` per call means every client starts without a token
+    status and pays a ``/token`` round trip before its first query. The pool keeps
+    a handful of long-lived clients, and seeds each one with the latest status
+    observed by any of them so the handshake only happens once per process.
+    """
+
+    def __init__(self, accesskey: str, size: int = KEEPA_POOL_SIZE, timeout: float = KEEPA_TIMEOUT):
+        self.accesskey = accesskey
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._status = {'tokensLeft': None, 'refillIn': None, 'refillRate': None, 'timestamp': None}
+        self._async_client = None
+        self.scheduler = KeepaTokenScheduler(_scheduler_state_path(accesskey))
+        self.clients_created = 0
+        self.async_clients_created = 0
+        self.handshakes = 0
+        self.calls = 0
+
+    def _new_client(self) -> keepa.Keepa:
+        pool = self
+
+        class _PooledKeepa(keepa.Keepa):
+            def update_status(self):
+                with pool._lock:
+                    pool.handshakes += 1
+                super().update_status()
+
+        return _PooledKeepa(self.accesskey, timeout=self.timeout, logging_level="WARNING")
+
+    def _acquire(self) -> keepa.Keepa:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self.clients_created < self.size
+            if can_create:
+                # Reserve the slot before constructing outside the lock
+                self.clients_created += 1
+        if not can_create:
+            # Waiting for a busy client is bounded by the request deadline too
+            left = time_left()
+            try:
+                return self._idle.get(timeout=None if left is None else max(left, 0))
+            except queue.Empty:
+                raise DeadlineExceeded() from None
+        try:
+            return self._new_client()
+        except Exception:
+            with self._lock:
+                self.clients_created -= 1
+            raise
+
+    def _load_status(self, api: keepa.Keepa) -> None:
+        with self._lock:
+            status = dict(self._status)
+        if status['timestamp'] is None:
+            return
+        if api.status.timestamp is None or api.status.timestamp < status['timestamp']:
+            for key, value in status.items():
+                setattr(api.status, key, value)
+            api.tokens_left = status['tokensLeft']
+
+    def _store_status(self, api: keepa.Keepa) -> None:
+        if api.status.timestamp is None:
+            return
+        with self._lock:
+            newer = self._status['timestamp'] is None or api.status.timestamp > self._status['timestamp']
+            if newer:
+                self._status = {
+                    'tokensLeft': api.tokens_left,
+                    'refillIn': api.status.refillIn,
+                    'refillRate': api.status.refillRate,
+                    'timestamp': api.status.timestamp,
+                }
+        if newer:
+            self.scheduler.observe(api.tokens_left, api.status.refillRate)
+
+    def _raise_if_out_of_tokens(self, api, error: RuntimeError, cost: float) -> None:
+        # Calls are made with wait=False, so Keepa reports an empty bucket instead of sleeping
+        if str(error) == "NOT_ENOUGH_TOKEN":
+            self._store_status(api)
+            raise KeepaTokensExhausted(self.scheduler.retry_after(cost)) from error
+
+    @staticmethod
+    def _trace_call(current, api, queued_for: float, error: Optional[RuntimeError] = None) -> None:
+        if current is not None:
+            current.set_attributes({
+                'keepa.queue_ms': round(queued_for * 1000, 1),
+                'keepa.tokens_left': api.tokens_left,
+                # The library turns Keepa's HTTP errors into RuntimeError(SCODES[status])
+                'http.status_code': 200 if error is None else KEEPA_HTTP_STATUS.get(str(error), 500),
+            })
+
+    @contextmanager
+    def client(self, cost: float = 0, op: str = "request", asins: int = 0):
+        """Borrow a client after reserving ``cost`` tokens from the shared scheduler."""
+        with span(f"keepa.{op}", {'keepa.token_cost': cost, 'keepa.asin_count': asins, 'retry.count': 0}) as current:
+            budget(self.timeout)  # don't queue for tokens once the deadline has passed
+            queued = time.monotonic()
+            self.scheduler.acquire(cost)
+            api = self._acquire()
+            queued_for = time.monotonic() - queued
+            self._load_status(api)
+            with self._lock:
+                self.calls += 1
+            record_outbound("keepa")
+            try:
+                # Pooled clients serve one call at a time, so each borrow gets its own timeout
+                api._timeout = budget(self.timeout)
+                yield api
+                self._trace_call(current, api, queued_for)
+            except RuntimeError as e:
+                self._trace_call(current, api, queued_for, e)
+                self._raise_if_out_of_tokens(api, e, cost)
+                raise
+            except requests.Timeout as e:
+                # query_products may have lowered the timeout further for its later chunks
+                if api._timeout < self.timeout:
+                    raise DeadlineExceeded() from e
+                raise
+            finally:
+                self._store_status(api)
+                self._idle.put(api)
+
+    async def _get_async_client(self) -> keepa.AsyncKeepa:
+        # One AsyncKeepa serves every coroutine in this process; no awaits happen
+        # between the check and the assignment, so it is only ever created once
+        if self._async_client is None:
+            api = await keepa.AsyncKeepa.create(self.accesskey, timeout=self.timeout)
+            update_status = api.update_status
+
+            async def counted_update_status():
+                with self._lock:
+                    self.handshakes += 1
+                await update_status()
+
+            api.update_status = counted_update_status
+            self._async_client = api
+            with self._lock:
+                self.async_clients_created += 1
+        return self._async_client
+
+    @asynccontextmanager
+    async def async_client(self, cost: float = 0, op: str = "request", asins: int = 0):
+        with span(f"keepa.{op}", {'keepa.token_cost': cost, 'keepa.asin_count': asins, 'retry.count': 0}) as current:
+            budget(self.timeout)
+            queued = time.monotonic()
+            await self.scheduler.acquire_async(cost)
+            api = await self._get_async_client()
+            queued_for = time.monotonic() - queued
+            self._load_status(api)
+            with self._lock:
+                self.calls += 1
+            record_outbound("keepa")
+            try:
+                # The AsyncKeepa client is shared, so the deadline bounds the call instead of its timeout
+                async with asyncio.timeout(time_left()) as bound:
+                    yield api
+                self._trace_call(current, api, queued_for)
+            except TimeoutError as e:
+                if bound.expired():
+                    raise DeadlineExceeded() from e
+                raise
+            except RuntimeError as e:
+                self._trace_call(current, api, queued_for, e)
+                await run_in_threadpool(self._raise_if_out_of_tokens, api, e, cost)
+                raise
+            finally:
+                # Updates the shared scheduler file
+                await run_in_threadpool(self._store_status, api)
+
+    def warm_up(self) -> None:
+        """Create one client and fetch the token status so the first request skips the handshake."""
+        with self.client(op="token") as api:
+            api.update_status()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pool_size': self.size,
+                'clients_created': self.clients_created,
+                'async_clients_created': self.async_clients_created,
+                'clients_idle': self._idle.qsize(),
+                'handshakes': self.handshakes,
+                'calls': self.calls,
+                'tokens_left': self._status['tokensLeft'],
+                'refill_rate': self._status['refillRate'],
+                'scheduler': self.scheduler.stats(),
+            }
+
+_keepa_pools: Dict[str, KeepaClientPool] = {}
+_keepa_pools_lock = threading.Lock()
+
+def get_keepa_pool(keepa_key: str) -> KeepaClientPool:
+    pool = _keepa_pools.get(keepa_key)
+    if pool is None:
+        with _keepa_pools_lock:
+            pool = _keepa_pools.setdefault(keepa_key, KeepaClientPool(keepa_key))
+    return pool
 
 # --- Keepa helpers ---
-def get_seller_asins(keepa_key: str, seller_id: str, domain: str, max_asins: int = 50, category_id: Optional[int] = None) -> List[str]:
+def _product_finder_parms(seller_id: str, page: int, category_id: Optional[int]) -> Dict:
+    product_parms = {'sellerIds': seller_id, 'perPage': KEEPA_FINDER_PAGE, 'page': page}
+    
+    # The strict filter compares rootCategory, so ask the finder for exactly that
+    if category_id is not None:
+        product_parms['rootCategory'] = [str(category_id)]
+    return product_parms
+
+def _finder_cost() -> int:
+    return KEEPA_FINDER_COST + -(-KEEPA_FINDER_PAGE // 100)
+
+def _finder_pages(offset: int, limit: int) -> range:
+    return range(offset // KEEPA_FINDER_PAGE, (offset + limit - 1) // KEEPA_FINDER_PAGE + 1)
+
+def _slice_finder_pages(pages: List[List[str]], offset: int, limit: int):
+    start = offset % KEEPA_FINDER_PAGE
+    asins = [a for page in pages for a in page][start:]
+    # A full last page means Keepa may have more results after it
+    has_more = len(asins) > limit or len(pages[-1]) == KEEPA_FINDER_PAGE
+    return asins[:limit], has_more
+
+def _finder_disk_key(seller_id: str, domain: str, page: int, category_id: Optional[int]) -> str:
+    return f"{domain}:{seller_id}:{category_id}:{KEEPA_FINDER_PAGE}:{page}"
+
+def _find_page(keepa_key: str, seller_id: str, domain: str, page: int, category_id: Optional[int]) -> List[str]:
+    def call():
+        disk_key = _finder_disk_key(seller_id, domain, page, category_id)
+        cached = disk_cache.get_many('finder', [disk_key])
+        if cached:
+            return cached[disk_key][0]
+        product_parms = _product_finder_parms(seller_id, page, category_id)
+        with get_keepa_pool(keepa_key).client(cost=_finder_cost(), op="product_finder") as api:
+            asins = list(api.product_finder(product_parms, domain=domain, wait=False) or [])
+        disk_cache.set_many('finder', {disk_key: asins}, FINDER_CACHE_TTL)
+        return asins
+    return flights['product_finder'].do((keepa_key, seller_id, domain, page, category_id), call)
+
+async def _find_page_async(keepa_key: str, seller_id: str, domain: str, page: int, category_id: Optional[int]) -> List[str]:
+    async def call():
+        disk_key = _finder_disk_key(seller_id, domain, page, category_id)
+        cached = await disk_cache.get_many_async('finder', [disk_key])
+        if cached:
+            return cached[disk_key][0]
+        product_parms = _product_finder_parms(seller_id, page, category_id)
+        async with get_keepa_pool(keepa_key).async_client(cost=_finder_cost(), op="product_finder") as api:
+            asins = list(await api.product_finder(product_parms, domain=domain, wait=False) or [])
+        await disk_cache.set_many_async('finder', {disk_key: asins}, FINDER_CACHE_TTL)
+        return asins
+    return await flights['product_finder'].do_async((keepa_key, seller_id, domain, page, category_id), call)
+
+def get_seller_asins_page(keepa_key: str, seller_id: str, domain: str, offset: int, limit: int, category_id: Optional[int] = None):
+    """Return ``(asins, has_more)`` for the storefront slice ``[offset, offset + limit)``."""
     try:
-        api = keepa.Keepa(keepa_key)
-        product_parms = {'sellerIds': seller_id, 'pageSize': max_asins}
-        
-        if category_id is not None:
-            product_parms['category'] = str(category_id)
-        
-        asins = api.product_finder(product_parms, domain=domain)
-        return asins[:max_asins] if asins else []
+        pages = []
+        for page in _finder_pages(offset, limit):
+            pages.append(_find_page(keepa_key, seller_id, domain, page, category_id))
+            if len(pages[-1]) < KEEPA_FINDER_PAGE:
+                break
+        return _slice_finder_pages(pages, offset, limit)
+    except (KeepaTokensExhausted, DeadlineExceeded):
+        raise
     except Exception as e:
         raise RuntimeError(f"ASIN fetch error: {e}")
 
-def get_product_details_batch(keepa_key: str, asins: List[str], domain: str) -> List[Dict]:
-    if not asins:
-        return []
+async def get_seller_asins_page_async(keepa_key: str, seller_id: str, domain: str, offset: int, limit: int, category_id: Optional[int] = None):
     try:
-        api = keepa.Keepa(keepa_key)
-        products = api.query(asins, domain=domain, stats=90)
-        product_details = []
-        for product in products:
-            if 'asin' not in product:
-                continue
-            
-            stats = product.get('stats', {})
-            current_data = stats.get('current', [0]*25)
-            
-            # --- IMAGE URL EXTRACTION ---
-            image_url = None
-            if product.get('image'):
-                image_url = product['image']
-            elif product.get('imagesCSV'):
-                image_path_segment = product['imagesCSV'].split(',')[0]
-                image_url = f"https://m.media-amazon.com/images/I/{image_path_segment}"
-
-            # --- ROBUST PRICE EXTRACTION LOGIC ---
-            current_price_cents = 0
-            if current_data[0] > 0: current_price_cents = current_data[0]
-            elif current_data[13] > 0: current_price_cents = current_data[13]
-            elif current_data[7] > 0: current_price_cents = current_data[7]
-            elif current_data[1] > 0: current_price_cents = current_data[1]
-
-            current_price = current_price_cents / 100 if current_price_cents > 0 else None
-            sales_rank = current_data[3] if isinstance(current_data, list) and len(current_data) > 3 and current_data[3] > 0 else None
-            rating_value = product.get('rating', 0) / 10.0 if product.get('rating') is not None else 0.0
-            review_count = product.get('reviewCount', 0)
-            
-            details = {
-                'asin': product.get('asin'),
-                'title': product.get('title', 'N/A'),
-                'brand': product.get('brand', 'N/A'),
-                'category_id': product.get('rootCategory', 'N/A'),
-                'category_name': None,
-                'sales_rank': sales_rank or 0,
-                'rating_value': rating_value,  
-                'review_count': review_count,
-                'rating_display': f"{rating_value:.1f}/5 ({review_count:,} reviews)", 
-                'current_price': f"${current_price:.2f}" if current_price else 'N/A',
-                'image_url': image_url
-            }
-            product_details.append(details)
-        return product_details
+        pages = []
+        for page in _finder_pages(offset, limit):
+            pages.append(await _find_page_async(keepa_key, seller_id, domain, page, category_id))
+            if len(pages[-1]) < KEEPA_FINDER_PAGE:
+                break
+        return _slice_finder_pages(pages, offset, limit)
+    except (KeepaTokensExhausted, DeadlineExceeded):
+        raise
     except Exception as e:
-        raise RuntimeError(f"Product details error: {e}")
+        raise RuntimeError(f"ASIN fetch error: {e}")
+
+def get_seller_asins(keepa_key: str, seller_id: str, domain: str, max_asins: int = 50, category_id: Optional[int] = None) -> List[str]:
+    return get_seller_asins_page(keepa_key, seller_id, domain, 0, max_asins, category_id)[0]
+
+IMAGE_URL_PREFIX = "https://m.media-amazon.com/images/I/"
+
+class ProductRecord:
+    """One parsed Keepa product, kept as raw numbers; display strings are built in _format_products.
+
+    Records are shared through the product cache, so treat them as read-only.
+    """
+    __slots__ = ('asin', 'title', 'brand', 'category_id', 'sales_rank', 'rating', 'review_count', 'price_cents', 'image')
+
+    def __init__(self, asin, title, brand, category_id, sales_rank, rating, review_count, price_cents, image):
+        self.asin = asin
+        self.title = title
+        self.brand = brand
+        self.category_id = category_id      # rootCategory, None when Keepa has none
+        self.sales_rank = sales_rank        # 0 when unranked
+        self.rating = rating                # Keepa tenths of a star (45 == 4.5/5)
+        self.review_count = review_count
+        self.price_cents = price_cents      # 0 when there is no current price
+        self.image = image                  # first imagesCSV entry, or a full URL
+
+    @property
+    def image_url(self) -> Optional[str]:
+        if self.image is None or '://' in self.image:
+            return self.image
+        return IMAGE_URL_PREFIX + self.image
+
+    @property
+    def rating_display(self) -> str:
+        return f"{self.rating / 10.0:.1f}/5 ({self.review_count:,} reviews)"
+
+    @property
+    def price_display(self) -> str:
+        return f"${self.price_cents / 100:.2f}" if self.price_cents > 0 else 'N/A'
+
+def parse_product_details(products: List[Dict]) -> List[ProductRecord]:
+    product_details = []
+    for product in products:
+        if 'asin' not in product:
+            continue
+        
+        stats = product.get('stats', {})
+        current_data = stats.get('current', [0]*25)
+        
+        # --- IMAGE EXTRACTION (the URL is built at serialization) ---
+        image = None
+        if product.get('image'):
+            image = product['image']
+        elif product.get('imagesCSV'):
+            image = product['imagesCSV'].split(',')[0]
+
+        # --- ROBUST PRICE EXTRACTION LOGIC ---
+        current_price_cents = 0
+        if current_data[0] > 0: current_price_cents = current_data[0]
+        elif current_data[13] > 0: current_price_cents = current_data[13]
+        elif current_data[7] > 0: current_price_cents = current_data[7]
+        elif current_data[1] > 0: current_price_cents = current_data[1]
+
+        sales_rank = current_data[3] if isinstance(current_data, list) and len(current_data) > 3 and current_data[3] > 0 else None
+        root_category = product.get('rootCategory')
+
+        product_details.append(ProductRecord(
+            asin=product.get('asin'),
+            title=product.get('title', 'N/A'),
+            brand=product.get('brand', 'N/A'),
+            category_id=root_category if root_category != 'N/A' else None,
+            sales_rank=sales_rank or 0,
+            rating=product.get('rating') or 0,
+            review_count=product.get('reviewCount', 0),
+            price_cents=current_price_cents,
+            image=image,
+        ))
+    return product_details
+
+def _memory_product_details(asins: List[str], domain: str):
+    details, missing = {}, []
+    for asin in dict.fromkeys(asins):
+        cached = product_cache.get((domain, asin))
+        if cached is not None:
+            details[asin] = cached
+        else:
+            missing.append(asin)
+    return details, missing
+
+def _product_disk_keys(asins: List[str], domain: str) -> List[str]:
+    return [f"{domain}:{asin}" for asin in asins]
+
+def _merge_disk_products(on_disk: Dict[str, tuple], details: Dict[str, ProductRecord], missing: List[str], domain: str):
+    if on_disk:
+        still_missing = []
+        for asin in missing:
+            entry = on_disk.get(f"{domain}:{asin}")
+            if entry is None:
+                still_missing.append(asin)
+                continue
+            record = ProductRecord(*entry[0])
+            product_cache.set((domain, asin), record, ttl=entry[1])
+            details[asin] = record
+        missing = still_missing
+    return details, missing
+
+def _cached_product_details(asins: List[str], domain: str):
+    details, missing = _memory_product_details(asins, domain)
+    # Memory misses fall through to the shared disk tier before they cost Keepa tokens
+    return _merge_disk_products(disk_cache.get_many('product', _product_disk_keys(missing, domain)), details, missing, domain)
+
+async def _cached_product_details_async(asins: List[str], domain: str):
+    details, missing = _memory_product_details(asins, domain)
+    on_disk = await disk_cache.get_many_async('product', _product_disk_keys(missing, domain))
+    return _merge_disk_products(on_disk, details, missing, domain)
+
+def query_products(api: keepa.Keepa, asins: List[str], domain: str, mode: str = KEEPA_PRODUCT_MODE) -> List[Dict]:
+    products = []
+    # Chunked here rather than in the library so each request only gets what is left of the deadline
+    for i in range(0, len(asins), KEEPA_QUERY_CHUNK):
+        chunk = asins[i:i + KEEPA_QUERY_CHUNK]
+        api._timeout = budget(KEEPA_TIMEOUT)
+        if mode == "full":
+            products.extend(api.query(chunk, domain=domain, stats=90, progress_bar=False, wait=False))
+            continue
+        # raw=True returns the HTTP response itself and skips every library parser
+        responses = api.query(chunk, domain=domain, stats=90, history=False, rating=False,
+                              to_datetime=False, progress_bar=False, raw=True, wait=False)
+        for resp in responses:
+            products.extend(resp.json().get('products') or [])
+    return products
+
+async def query_products_async(api: keepa.AsyncKeepa, asins: List[str], domain: str, mode: str = KEEPA_PRODUCT_MODE) -> List[Dict]:
+    products = []
+    for i in range(0, len(asins), KEEPA_QUERY_CHUNK):
+        chunk = asins[i:i + KEEPA_QUERY_CHUNK]
+        # The deadline already bounds the whole call (see async_client); this stops before a chunk it can't cover
+        budget(KEEPA_TIMEOUT)
+        if mode == "full":
+            products.extend(await api.query(chunk, domain=domain, stats=90, progress_bar=False, wait=False))
+            continue
+        # AsyncKeepa has no raw mode; without history there is no CSV to decode and
+        # to_datetime=False keeps the stats pass from building datetime arrays
+        products.extend(await api.query(chunk, domain=domain, stats=90, history=False, rating=False,
+                                        to_datetime=False, progress_bar=False, wait=False))
+    return products
+
+def _store_product_details(fresh: List[ProductRecord], domain: str, details: Dict[str, ProductRecord]) -> Dict[str, list]:
+    """Fill the memory tiers and ``details``; returns the rows for the disk tier."""
+    for d in fresh:
+        product_cache.set((domain, d.asin), d)
+        details[d.asin] = d
+    return {f"{domain}:{d.asin}": [getattr(d, f) for f in ProductRecord.__slots__] for d in fresh}
+
+def get_product_details_batch(keepa_key: str, asins: List[str], domain: str) -> List[ProductRecord]:
+    if not asins:
+        return []
+    details, missing = _cached_product_details(asins, domain)
+    if missing:
+        try:
+            def call():
+                with get_keepa_pool(keepa_key).client(cost=len(missing) * KEEPA_TOKENS_PER_PRODUCT, op="product", asins=len(missing)) as api:
+                    return query_products(api, missing, domain)
+            products = flights['product_query'].do((keepa_key, domain, tuple(missing)), call)
+            rows = _store_product_details(parse_product_details(products), domain, details)
+            disk_cache.set_many('product', rows, PRODUCT_CACHE_TTL)
+        except (KeepaTokensExhausted, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Product details error: {e}")
+    return [details[a] for a in asins if a in details]
+
+async def get_product_details_batch_async(keepa_key: str, asins: List[str], domain: str) -> List[ProductRecord]:
+    if not asins:
+        return []
+    details, missing = await _cached_product_details_async(asins, domain)
+    if missing:
+        try:
+            async def call():
+                async with get_keepa_pool(keepa_key).async_client(cost=len(missing) * KEEPA_TOKENS_PER_PRODUCT, op="product", asins=len(missing)) as api:
+                    return await query_products_async(api, missing, domain)
+            products = await flights['product_query'].do_async((keepa_key, domain, tuple(missing)), call)
+            rows = _store_product_details(parse_product_details(products), domain, details)
+            await disk_cache.set_many_async('product', rows, PRODUCT_CACHE_TTL)
+        except (KeepaTokensExhausted, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Product details error: {e}")
+    return [details[a] for a in asins if a in details]
+
+def _memory_category_names(category_ids: List[int], domain: str):
+    names = {}
+    missing = []
+    for cid in dict.fromkeys(category_ids):
+        # Root categories come straight from the shared tree; the caches and Keepa are the fallback
+        cached = category_tree.lookup(domain, cid)
+        if cached is None:
+            cached = category_cache.get((domain, cid))
+        if cached is not None:
+            names[cid] = cached
+        else:
+            missing.append(cid)
+    return names, missing
+
+def _category_disk_keys(category_ids: List[int], domain: str) -> List[str]:
+    return [f"{domain}:{cid}" for cid in category_ids]
+
+def _merge_disk_categories(on_disk: Dict[str, tuple], names: Dict[int, str], missing: List[int], domain: str):
+    if on_disk:
+        for cid in missing:
+            entry = on_disk.get(f"{domain}:{cid}")
+            if entry is not None:
+                category_cache.set((domain, cid), entry[0], ttl=entry[1])
+                names[cid] = entry[0]
+        missing = [cid for cid in missing if cid not in names]
+    return names, [missing[i:i + KEEPA_CATEGORY_BATCH] for i in range(0, len(missing), KEEPA_CATEGORY_BATCH)]
+
+def _cached_category_names(category_ids: List[int], domain: str):
+    names, missing = _memory_category_names(category_ids, domain)
+    return _merge_disk_categories(disk_cache.get_many('category', _category_disk_keys(missing, domain)), names, missing, domain)
+
+async def _cached_category_names_async(category_ids: List[int], domain: str):
+    names, missing = _memory_category_names(category_ids, domain)
+    on_disk = await disk_cache.get_many_async('category', _category_disk_keys(missing, domain))
+    return _merge_disk_categories(on_disk, names, missing, domain)
+
+def _store_category_batch(batch: List[int], categories: Optional[Dict], domain: str, names: Dict[int, str]) -> Dict[str, str]:
+    """Fill the memory cache and ``names``; returns the rows for the disk tier."""
+    if categories is None:
+        # Failures are not cached so the next request retries them
+        names.update({cid: 'Category Lookup Failed' for cid in batch})
+        return {}
+    for cid in batch:
+        category_obj = categories.get(str(cid))
+        name = category_obj.get('name', 'Unknown Category') if category_obj else 'Unknown Category'
+        category_cache.set((domain, cid), name)
+        names[cid] = name
+    return {f"{domain}:{cid}": names[cid] for cid in batch}
+
+def get_category_names(keepa_key: str, category_ids: List[int], domain: str) -> Dict[int, str]:
+    """Resolve category names, serving from cache and batching lookups for the misses."""
+    names, batches = _cached_category_names(category_ids, domain)
+    def call(batch):
+        with get_keepa_pool(keepa_key).client(cost=KEEPA_CATEGORY_COST, op="category_lookup") as api:
+            return api.category_lookup(",".join(map(str, batch)), domain=domain, wait=False)
+
+    for batch in batches:
+        try:
+            categories = flights['category_lookup'].do((keepa_key, domain, tuple(batch)), lambda: call(batch))
+        except DeadlineExceeded:
+            skip_stage("category_names")
+            categories = None
+        except Exception:
+            categories = None
+        disk_cache.set_many('category', _store_category_batch(batch, categories, domain, names), CATEGORY_CACHE_TTL)
+    return names
+
+async def get_category_names_async(keepa_key: str, category_ids: List[int], domain: str) -> Dict[int, str]:
+    names, batches = await _cached_category_names_async(category_ids, domain)
+
+    async def call(batch):
+        async with get_keepa_pool(keepa_key).async_client(cost=KEEPA_CATEGORY_COST, op="category_lookup") as api:
+            return await api.category_lookup(",".join(map(str, batch)), domain=domain, wait=False)
+
+    async def lookup(batch):
+        try:
+            return await flights['category_lookup'].do_async((keepa_key, domain, tuple(batch)), lambda: call(batch))
+        except DeadlineExceeded:
+            skip_stage("category_names")
+            return None
+        except Exception:
+            return None
+
+    results = await asyncio.gather(*(lookup(batch) for batch in batches))
+    rows = {}
+    for batch, categories in zip(batches, results):
+        rows.update(_store_category_batch(batch, categories, domain, names))
+    await disk_cache.set_many_async('category', rows, CATEGORY_CACHE_TTL)
+    return names
 
 def get_category_name(keepa_key: str, category_id: int, domain: str) -> str:
-    try:
-        api = keepa.Keepa(keepa_key)
-        categories = api.category_lookup(category_id, domain=domain)
-        category_obj = categories.get(str(category_id))
-        return category_obj.get('name', 'Unknown Category') if category_obj else 'Unknown Category'
-    except:
-        return 'Category Lookup Failed'
+    return get_category_names(keepa_key, [category_id], domain)[category_id]
 
-def parse_eligibility_result(eligibility_data: Dict, asin: str) -> Dict:
+def refresh_category_tree(keepa_key: str, domains: Optional[List[str]] = None, max_age: float = CATEGORY_TREE_MAX_AGE) -> List[str]:
+    """Rebuild the tree files older than ``max_age`` whose contents changed; returns the domains swapped."""
+    os.makedirs(CATEGORY_TREE_DIR, exist_ok=True)
+    swapped = []
+    with open(os.path.join(CATEGORY_TREE_DIR, ".refresh.lock"), 'a') as lock:
+        if fcntl:
+            try:
+                # One worker per host refreshes; the others pick up its files
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return swapped
+        for domain in domains or list(DOMAIN_MAP):
+            age = category_tree.age(domain)
+            if age is not None and age < max_age:
+                continue
+            try:
+                with get_keepa_pool(keepa_key).client(cost=KEEPA_CATEGORY_COST, op="category_lookup") as api:
+                    # Category 0 lists every root category of the marketplace
+                    categories = api.category_lookup(0, domain=domain, wait=False)
+            except Exception:
+                continue
+            names = {int(cid): c.get('name', 'Unknown Category') for cid, c in (categories or {}).items() if int(cid)}
+            if not names:
+                continue
+            changed = names != category_tree.names(domain)
+            # Unchanged trees are rewritten too, which restamps them until max_age passes again
+            category_tree.write(domain, names)
+            if changed:
+                swapped.append(domain)
+    return swapped
+
+# --- Eligibility cache ---
+def _cached_eligibility(seller_id: str, asins: List[str], marketplace: str):
+    cached_items, ages, missing = [], {}, []
+    now = time.time()
+    for asin in asins:
+        entry = eligibility_cache.get((seller_id, marketplace, asin))
+        if entry is None:
+            missing.append(asin)
+        else:
+            cached_items.append(entry['item'])
+            ages[asin] = now - entry['cached_at']
+    return cached_items, ages, missing
+
+def _merge_eligibility(seller_id: str, marketplace: str, cached_items: List[Dict], ages: Dict[str, float], fresh: Optional[Dict]) -> Dict:
+    if fresh is None:
+        return {'success': True, 'data': cached_items, 'cache_age': ages}
+    if not fresh.get('success') or not isinstance(fresh.get('data'), list):
+        # Keep the upstream error so uncached ASINs are reported as API errors
+        return {**fresh, 'data': cached_items, 'cache_age': ages}
+
+    now = time.time()
+    for item in fresh['data']:
+        if isinstance(item, dict) and item.get('asin') and 'isEligible' in item:
+            ttl = ELIGIBLE_TTL if item['isEligible'] else RESTRICTED_TTL
+            eligibility_cache.set((seller_id, marketplace, item['asin']), {'item': item, 'cached_at': now}, ttl=ttl)
+    return {'success': True, 'data': cached_items + fresh['data'], 'cache_age': ages}
+
+def check_eligibility_cached(seller_id: str, asins: List[str], marketplace: str) -> Dict:
+    cached_items, ages, missing = _cached_eligibility(seller_id, asins, marketplace)
+    fresh = optisage.check_seller_eligibility(seller_id, missing, marketplace) if missing else None
+    return _merge_eligibility(seller_id, marketplace, cached_items, ages, fresh)
+
+async def check_eligibility_cached_async(seller_id: str, asins: List[str], marketplace: str) -> Dict:
+    cached_items, ages, missing = _cached_eligibility(seller_id, asins, marketplace)
+    fresh = await optisage.check_seller_eligibility_async(seller_id, missing, marketplace) if missing else None
+    return _merge_eligibility(seller_id, marketplace, cached_items, ages, fresh)
+
+ELIGIBLE = {'status': '✅ Eligible', 'reason': 'Seller is eligible to sell this product'}
+RESTRICTED = {'status': '❌ Restricted', 'reason': 'Seller is not eligible to sell this product'}
+UNAVAILABLE = {'status': '⏸️ Unavailable', 'reason': 'OptiSage is failing; eligibility was not checked'}
+SKIPPED = {'status': '⏱️ Skipped', 'reason': 'Request deadline reached before eligibility was checked'}
+
+def index_eligibility(eligibility_data: Dict) -> Tuple[Dict[str, Dict], Dict]:
+    """Decode an OptiSage payload once into ``(asin -> result, result for ASINs it does not cover)``."""
     if not eligibility_data:
-        return {'status': '❓ API Error', 'reason': 'No eligibility data received'}
+        return {}, {'status': '❓ API Error', 'reason': 'No eligibility data received'}
     try:
+        index = {}
         if 'data' in eligibility_data and isinstance(eligibility_data['data'], list):
             for item in eligibility_data['data']:
-                if item.get('asin') == asin:
-                    is_eligible = item.get('isEligible', False)
-                    if is_eligible:
-                        return {'status': '✅ Eligible', 'reason': 'Seller is eligible to sell this product'}
-                    else:
-                        return {'status': '❌ Restricted', 'reason': 'Seller is not eligible to sell this product'}
-        elif not eligibility_data.get('success', True):
+                if item.get('degraded'):
+                    result = UNAVAILABLE
+                elif item.get('skipped'):
+                    result = SKIPPED
+                elif 'error' in item and 'isEligible' not in item:
+                    # ASIN of a chunk whose OptiSage call failed while the others succeeded
+                    result = {'status': '❓ API Error', 'reason': f"{item['error']}: {item.get('details', '')[:50]}..."}
+                else:
+                    result = ELIGIBLE if item.get('isEligible', False) else RESTRICTED
+                # First answer for an ASIN wins, as with the old front-to-back scan
+                index.setdefault(item.get('asin'), result)
+        if eligibility_data.get('degraded'):
+            return index, UNAVAILABLE
+        if eligibility_data.get('skipped'):
+            return index, SKIPPED
+        if not eligibility_data.get('success', True):
             error_msg = eligibility_data.get('error', 'OptiSage API failed')
             details = eligibility_data.get('details', '')
-            return {'status': '❓ API Error', 'reason': f'{error_msg}: {details[:50]}...'}
-            
-        return {'status': '⚠️ Not Found', 'reason': 'ASIN not found in eligibility results'}
+            return index, {'status': '❓ API Error', 'reason': f'{error_msg}: {details[:50]}...'}
+
+        return index, {'status': '⚠️ Not Found', 'reason': 'ASIN not found in eligibility results'}
     except Exception as e:
-        return {'status': '🔧 Parse Error', 'reason': f'Failed to parse eligibility: {str(e)}'}
+        return {}, {'status': '🔧 Parse Error', 'reason': f'Failed to parse eligibility: {str(e)}'}
 
-# --- Main endpoint with manual filtering ---
-@app.post("/analyze_seller", summary="Analyze seller storefront")
-def analyze_seller(req: SellerRequest):
+def eligibility_status(index: Dict[str, Dict], fallback: Dict, asin: str) -> Dict:
+    return index.get(asin, fallback)
+
+def parse_eligibility_result(eligibility_data: Dict, asin: str) -> Dict:
+    # Single lookups only; anything formatting a list should build the index once
+    return eligibility_status(*index_eligibility(eligibility_data), asin)
+
+# --- Lifecycle & stats ---
+async def trace_requests(request: Request, call_next):
+    # Root span of the request, continuing the caller's trace when it sent a traceparent
+    with tracer.start_as_current_span(f"{request.method} {request.url.path}", context=propagate.extract(request.headers),
+                                      kind=trace.SpanKind.SERVER,
+                                      attributes={'http.method': request.method, 'http.target': request.url.path}) as current:
+        response = await call_next(request)
+        current.set_attribute('http.status_code', response.status_code)
+        return response
+
+if tracer is not None:
+    app.middleware("http")(trace_requests)
+
+# Handlers run in the endpoint's context, so failed requests still get their timing and "total"
+@app.exception_handler(HTTPException)
+async def http_exception(request: Request, exc: HTTPException):
+    return finish_request_timer(await http_exception_handler(request, exc))
+
+@app.exception_handler(KeepaTokensExhausted)
+async def keepa_tokens_exhausted(request: Request, exc: KeepaTokensExhausted):
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return finish_request_timer(JSONResponse(status_code=429, headers={"Retry-After": str(retry_after)},
+                                             content={"detail": f"Keepa token budget exhausted. Retry in {retry_after} seconds."}))
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    # The pipelines turn a passed deadline into a partial response; this only catches other paths
+    return finish_request_timer(JSONResponse(status_code=504, content={"detail": str(exc)}))
+
+@app.on_event("startup")
+def warm_up_clients():
+    # A failed warm-up is not fatal: the first request will do the handshake instead
+    try:
+        get_keepa_pool(KEEPA_API_KEY).warm_up()
+    except Exception:
+        pass
+
+@app.on_event("startup")
+def start_category_tree_refresh():
+    if CATEGORY_TREE_MAX_AGE <= 0:
+        return
+
+    def loop():
+        while True:
+            try:
+                refresh_category_tree(KEEPA_API_KEY)
+            except Exception:
+                pass
+            time.sleep(min(CATEGORY_TREE_MAX_AGE, 3600))
+
+    # Off the startup path: requests fall back to the category caches until the files exist
+    threading.Thread(target=loop, name="category-tree-refresh", daemon=True).start()
+
+@app.on_event("startup")
+async def warm_up_optisage():
+    if ANALYZE_MODE == "sync":
+        await run_in_threadpool(optisage.warm_up, OPTISAGE_PREWARM)
+    else:
+        await optisage.warm_up_async(OPTISAGE_PREWARM)
+
+@app.on_event("shutdown")
+async def close_clients():
+    optisage.close()
+    await optisage.close_async()
+    if tracer_provider is not None:
+        tracer_provider.shutdown()  # flushes spans still queued for export
+
+@app.get("/stats", summary="Internal client and cache statistics")
+def stats():
+    return {
+        "analyze_mode": ANALYZE_MODE,
+        "single_flight": {name: flight.stats() for name, flight in flights.items()},
+        "keepa_pool": get_keepa_pool(KEEPA_API_KEY).stats(),
+        "optisage_pool": optisage.stats(),
+        "category_cache": category_cache.stats(),
+        "eligibility_cache": eligibility_cache.stats(),
+        # A product found on disk skipped Keepa just like a memory hit
+        "product_cache": {**product_cache.stats(), 'tokens_saved': (product_cache.hits + disk_cache.hits_by_ns.get('product', 0)) * KEEPA_TOKENS_PER_PRODUCT},
+        "disk_cache": disk_cache.stats(),
+        "category_tree": category_tree.stats(),
+        "response_cache": response_cache.stats(),
+    }
+
+@app.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(stage_metrics.render() + optisage.render_metrics(), media_type="text/plain; version=0.0.4")
+
+# --- Pipeline stages shared by the sync and async paths ---
+def _validate_marketplace(req: SellerRequest) -> str:
     marketplace = req.marketplace.upper()
     if marketplace not in DOMAIN_MAP:
         raise HTTPException(status_code=400, detail=f"Unsupported marketplace '{req.marketplace}'. Use one of: {list(DOMAIN_MAP.keys())}")
+    return marketplace
 
-    requested_category_id_str = str(req.category_id) if req.category_id else None
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"o:{offset}".encode()).decode()
 
-    # 1) Get ASINs (Keepa filtering applied here, but might be loose)
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
     try:
-        asins = get_seller_asins(
-            KEEPA_API_KEY,  # Using environment variable
-            req.seller_id, 
-            domain=marketplace, 
-            max_asins=MAX_PRODUCTS,
-            category_id=req.category_id
-        )
-    except RuntimeError as e:
-        raise HTTPException(status_code=502, detail=f"Keepa ASIN Fetch Error: {str(e)}")
+        prefix, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        if prefix != "o" or int(offset) < 0:
+            raise ValueError
+        return int(offset)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
+def _raise_if_no_asins(req: SellerRequest, asins: List[str]) -> None:
     if not asins:
         filter_detail = f" in Category ID {req.category_id}" if req.category_id else ""
         raise HTTPException(status_code=404, detail=f"No ASINs found for this seller{filter_detail}.")
 
-    # 2) Get full product details
-    try:
-        products = get_product_details_batch(KEEPA_API_KEY, asins, domain=marketplace)  # Using environment variable
-    except RuntimeError as e:
-        raise HTTPException(status_code=502, detail=f"Keepa Product Details Error: {str(e)}")
+def _category_ids(products: List[ProductRecord]) -> List[int]:
+    return [int(p.category_id) for p in products if p.category_id]
 
-    # 3) Add category names AND **STRICTLY FILTER**
-    final_products = []
-    
-    for p in products:
-        cid = p.get('category_id')
-        
-        # 3a. Get Category Name
-        if cid and cid != 'N/A':
-            try:
-                category_name = get_category_name(KEEPA_API_KEY, int(cid), domain=marketplace)  # Using environment variable
-                p['category_name'] = category_name
-            except Exception:
-                p['category_name'] = 'Category lookup failed'
-        else:
-            p['category_name'] = 'Unknown'
-            
-        # 3b. 🟢 ENFORCE MANUAL FILTERING 🟢
-        # Only append the product if:
-        # 1. No category filter was requested (i.e., requested_category_id_str is None)
-        # OR
-        # 2. The fetched product's category ID matches the requested category ID
-        if requested_category_id_str is None or str(cid) == requested_category_id_str:
-            final_products.append(p)
+def _filter_by_category(req: SellerRequest, products: List[ProductRecord]) -> List[ProductRecord]:
+    # 🟢 ENFORCE MANUAL FILTERING 🟢
+    # The strict filter only needs rootCategory, so it runs before category names are
+    # resolved and the eligibility check can start as soon as product details arrive.
+    # Only keep the product if:
+    # 1. No category filter was requested (i.e., requested_category_id_str is None)
+    # OR
+    # 2. The fetched product's category ID matches the requested category ID
+    requested_category_id_str = str(req.category_id) if req.category_id else None
+    return [p for p in products if requested_category_id_str is None or str(p.category_id) == requested_category_id_str]
+
+def _apply_category_filter(req: SellerRequest, products: List[ProductRecord]) -> List[ProductRecord]:
+    final_products = _filter_by_category(req, products)
     
     # Check if any products remain after strict filtering
-    if not final_products and requested_category_id_str:
+    if not final_products and req.category_id:
         raise HTTPException(status_code=404, detail=f"No products matched the Seller ID and the strict filter for Category ID {req.category_id} after fetching.")
+    return final_products
 
-    # 4) Check eligibility on the final, filtered list
-    filtered_asins = [p.get('asin') for p in final_products]
-    
-    opti = OptiSageAPI(OPTISAGE_TOKEN)  # Using environment variable
-    eligibility_data = opti.check_seller_eligibility(req.seller_id, filtered_asins, marketplace)
-    
-    if not eligibility_data.get('success'):
-        # If OptiSage fails, use the error data for parsing (as implemented in the helper)
-        eligibility_data = eligibility_data
+def _category_name(p: ProductRecord, category_names: Dict[int, str]) -> str:
+    if p.category_id:
+        return category_names.get(int(p.category_id), 'Category lookup failed')
+    return 'Unknown'
 
-    # 5) Format response
+def _format_products(final_products: List[ProductRecord], eligibility_data: Dict, category_names: Dict[int, str],
+                     start_index: int = 0) -> List[Dict]:
     formatted = []
-    for idx, p in enumerate(final_products): # Iterate over final_products
-        asin = p.get('asin')
-        parsed = parse_eligibility_result(eligibility_data, asin)
+    cache_age = eligibility_data.get('cache_age', {})
+    index, fallback = index_eligibility(eligibility_data)
+    for idx, p in enumerate(final_products, start=start_index): # Iterate over final_products
+        asin = p.asin
+        parsed = eligibility_status(index, fallback, asin)
         formatted.append({
             "index": idx + 1,
             "ASIN": asin,
-            "Title": p.get('title', 'N/A'),
-            "Brand": p.get('brand', 'N/A'),
-            "Category": p.get('category_name', 'Unknown'),
-            "SalesRank": p.get('sales_rank'),
-            "Velocity": "🚀 YES (< 50K)" if p.get('sales_rank', 999999) < 50000 else "SLOW (> 50K)",
+            "Title": p.title,
+            "Brand": p.brand,
+            "Category": _category_name(p, category_names),
+            "SalesRank": p.sales_rank,
+            "Velocity": "🚀 YES (< 50K)" if p.sales_rank < 50000 else "SLOW (> 50K)",
             "Eligibility": parsed['status'],
             "Comment": parsed['reason'],
-            "Rating": p.get('rating_display', '0.0/5 (0 reviews)'), 
-            "Reviews": str(p.get('review_count', 'N/A')), 
-            "Price": p.get('current_price', 'N/A'),
-            "ImageURL": p.get('image_url', 'N/A')
+            "EligibilitySource": "cache" if asin in cache_age else "live",
+            "EligibilityAgeSeconds": int(cache_age.get(asin, 0)),
+            "Rating": p.rating_display, 
+            "Reviews": str(p.review_count), 
+            "Price": p.price_display,
+            "ImageURL": p.image_url
         })
+    return formatted
 
-    return {
+def _summary(req: SellerRequest, marketplace: str, total: int, next_cursor: Optional[str]) -> Dict:
+    summary = {
         "Seller": req.seller_id,
         "Marketplace": marketplace,
         "Filter_Category_ID": req.category_id if req.category_id else 'None',
-        "Total_Products": len(formatted),
-        "Products": formatted
+        "Total_Products": total,
+        "Next_Cursor": next_cursor,
     }
+    skipped = skipped_stages.get()
+    if skipped:
+        summary["Partial"] = True
+        summary["Skipped_Stages"] = [name for name in PIPELINE_STAGES if name in skipped]
+    return summary
+
+def _format_response(req: SellerRequest, marketplace: str, final_products: List[ProductRecord], eligibility_data: Dict,
+                     category_names: Dict[int, str], next_cursor: Optional[str] = None, offset: int = 0) -> Dict:
+    with stage("format"):
+        # "index" continues from the page's offset, as it does across the chunks of a stream
+        formatted = _format_products(final_products, eligibility_data, category_names, offset)
+    return {**_summary(req, marketplace, len(formatted), next_cursor), "Products": formatted}
+
+def _deadline_response(req: SellerRequest, marketplace: str, offset: int, first_skipped: str) -> Dict:
+    """Empty partial page for a deadline that passed before any product was analyzed."""
+    skip_stage(first_skipped, and_after=True)
+    # Nothing of this page was served, so the cursor points back at it
+    return _format_response(req, marketplace, [], {}, {}, encode_cursor(offset))
+
+def _stream_chunks(asins: List[str], first: bool):
+    size = STREAM_FIRST_CHUNK if first else STREAM_CHUNK
+    yield asins[:size]
+    for i in range(size, len(asins), STREAM_CHUNK):
+        yield asins[i:i + STREAM_CHUNK]
+
+def _stream_error(e: Exception) -> Dict:
+    if isinstance(e, KeepaTokensExhausted):
+        return {"error": str(e), "retry_after": max(1, math.ceil(e.retry_after))}
+    return {"error": e.detail}
+
+def _ndjson(record: Dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode()
+
+# --- Blocking pipeline (ANALYZE_MODE=sync) ---
+def _fetch_asins_sync(req: SellerRequest, marketplace: str, offset: int, limit: int):
+    # Keepa filtering applied here, but might be loose
+    try:
+        with stage("asin_fetch"):
+            return get_seller_asins_page(KEEPA_API_KEY, req.seller_id, domain=marketplace, offset=offset,
+                                         limit=limit, category_id=req.category_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"Keepa ASIN Fetch Error: {str(e)}")
+
+def _analyze_asins_sync(req: SellerRequest, marketplace: str, asins: List[str], strict: bool = True):
+    """Returns ``(final_products, eligibility_data, category_names)`` for one batch of ASINs."""
+    # Get full product details
+    try:
+        with stage("product_details"):
+            products = get_product_details_batch(KEEPA_API_KEY, asins, domain=marketplace)  # Using environment variable
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"Keepa Product Details Error: {str(e)}")
+
+    # **STRICTLY FILTER** on rootCategory; the ASIN list is final from here on
+    final_products = _apply_category_filter(req, products) if strict else _filter_by_category(req, products)
+    if not final_products:
+        return [], {}, {}
+    filtered_asins = [p.asin for p in final_products]
+
+    # Check eligibility while the category names are resolved (cached, batched)
+    eligibility_future = submit_stage(timed, "eligibility", check_eligibility_cached, req.seller_id, filtered_asins, marketplace)
+    with stage("category_names"):
+        category_names = get_category_names(KEEPA_API_KEY, _category_ids(final_products), domain=marketplace)
+    return final_products, eligibility_future.result(), category_names
+
+def analyze_seller_sync(req: SellerRequest) -> Dict:
+    marketplace = _validate_marketplace(req)
+    offset = decode_cursor(req.cursor)
+
+    # 1) Get this page of ASINs
+    try:
+        asins, has_more = _fetch_asins_sync(req, marketplace, offset, req.page_size)
+    except DeadlineExceeded:
+        return _deadline_response(req, marketplace, offset, "asin_fetch")
+    next_cursor = encode_cursor(offset + req.page_size) if has_more else None
+    if offset == 0:
+        _raise_if_no_asins(req, asins)
+    elif not asins:
+        return _format_response(req, marketplace, [], {}, {})
+
+    # 2-4) Product details, strict filter, then eligibility alongside category names
+    try:
+        final_products, eligibility_data, category_names = _analyze_asins_sync(req, marketplace, asins, strict=offset == 0)
+    except DeadlineExceeded:
+        return _deadline_response(req, marketplace, offset, "product_details")
+
+    # 5) Format response (OptiSage errors are rendered per product by the parser)
+    return _format_response(req, marketplace, final_products, eligibility_data, category_names, next_cursor, offset)
+
+def stream_seller_sync(req: SellerRequest, marketplace: str, offset: int, asins: List[str], has_more: bool):
+    # "index" continues from the cursor's offset, as it does across /analyze_seller pages
+    start, emitted = offset, 0
+    first = True
+    while True:
+        for chunk in _stream_chunks(asins, first):
+            try:
+                final_products, eligibility_data, category_names = _analyze_asins_sync(req, marketplace, chunk, strict=False)
+            except (HTTPException, KeepaTokensExhausted) as e:
+                yield _ndjson(_stream_error(e))
+                return
+            for record in _format_products(final_products, eligibility_data, category_names, start + emitted):
+                yield _ndjson(record)
+            emitted += len(final_products)
+        first = False
+        offset += len(asins)
+        if not has_more or offset >= STREAM_MAX_PRODUCTS:
+            break
+        try:
+            asins, has_more = _fetch_asins_sync(req, marketplace, offset, KEEPA_FINDER_PAGE)
+        except (HTTPException, KeepaTokensExhausted) as e:
+            yield _ndjson(_stream_error(e))
+            return
+    yield _ndjson(_summary(req, marketplace, emitted, encode_cursor(offset) if has_more else None))
+
+# --- Event-loop pipeline (ANALYZE_MODE=async) ---
+async def _fetch_asins_async(req: SellerRequest, marketplace: str, offset: int, limit: int):
+    try:
+        with stage("asin_fetch"):
+            return await get_seller_asins_page_async(KEEPA_API_KEY, req.seller_id, domain=marketplace, offset=offset,
+                                                     limit=limit, category_id=req.category_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"Keepa ASIN Fetch Error: {str(e)}")
+
+async def _analyze_asins_async(req: SellerRequest, marketplace: str, asins: List[str], strict: bool = True):
+    try:
+        with stage("product_details"):
+            products = await get_product_details_batch_async(KEEPA_API_KEY, asins, domain=marketplace)
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"Keepa Product Details Error: {str(e)}")
+
+    final_products = _apply_category_filter(req, products) if strict else _filter_by_category(req, products)
+    if not final_products:
+        return [], {}, {}
+    filtered_asins = [p.asin for p in final_products]
+
+    eligibility_data, category_names = await asyncio.gather(
+        timed_async("eligibility", check_eligibility_cached_async(req.seller_id, filtered_asins, marketplace)),
+        timed_async("category_names", get_category_names_async(KEEPA_API_KEY, _category_ids(final_products), domain=marketplace)),
+    )
+    return final_products, eligibility_data, category_names
+
+async def analyze_seller_async(req: SellerRequest) -> Dict:
+    marketplace = _validate_marketplace(req)
+    offset = decode_cursor(req.cursor)
+
+    # 1) Get this page of ASINs
+    try:
+        asins, has_more = await _fetch_asins_async(req, marketplace, offset, req.page_size)
+    except DeadlineExceeded:
+        return _deadline_response(req, marketplace, offset, "asin_fetch")
+    next_cursor = encode_cursor(offset + req.page_size) if has_more else None
+    if offset == 0:
+        _raise_if_no_asins(req, asins)
+    elif not asins:
+        return _format_response(req, marketplace, [], {}, {})
+
+    # 2-4) Product details, strict filter, then eligibility and category names concurrently
+    try:
+        final_products, eligibility_data, category_names = await _analyze_asins_async(req, marketplace, asins, strict=offset == 0)
+    except DeadlineExceeded:
+        return _deadline_response(req, marketplace, offset, "product_details")
+
+    # 5) Format response
+    return _format_response(req, marketplace, final_products, eligibility_data, category_names, next_cursor, offset)
+
+async def stream_seller_async(req: SellerRequest, marketplace: str, offset: int, asins: List[str], has_more: bool):
+    start, emitted = offset, 0
+    first = True
+    next_page = None
+    try:
+        while True:
+            # Fetch the next finder page while this one is being analyzed
+            if has_more and offset + len(asins) < STREAM_MAX_PRODUCTS:
+                next_page = asyncio.ensure_future(_fetch_asins_async(req, marketplace, offset + len(asins), KEEPA_FINDER_PAGE))
+            for chunk in _stream_chunks(asins, first):
+                try:
+                    final_products, eligibility_data, category_names = await _analyze_asins_async(req, marketplace, chunk, strict=False)
+                except (HTTPException, KeepaTokensExhausted) as e:
+                    yield _ndjson(_stream_error(e))
+                    return
+                for record in _format_products(final_products, eligibility_data, category_names, start + emitted):
+                    yield _ndjson(record)
+                emitted += len(final_products)
+            first = False
+            offset += len(asins)
+            if next_page is None:
+                break
+            try:
+                asins, has_more = await next_page
+            except (HTTPException, KeepaTokensExhausted) as e:
+                yield _ndjson(_stream_error(e))
+                return
+            finally:
+                next_page = None
+        yield _ndjson(_summary(req, marketplace, emitted, encode_cursor(offset) if has_more else None))
+    finally:
+        # The client may disconnect mid-stream
+        if next_page is not None:
+            next_page.cancel()
+
+# --- Multi-seller batch (always runs on the event loop) ---
+def _batch_error(req: SellerRequest, e: Exception) -> Dict:
+    if isinstance(e, HTTPException):
+        error = {"status_code": e.status_code, "detail": e.detail}
+    elif isinstance(e, KeepaTokensExhausted):
+        error = {"status_code": 429, "detail": str(e), "retry_after": max(1, math.ceil(e.retry_after))}
+    elif isinstance(e, DeadlineExceeded):
+        error = {"status_code": 504, "detail": str(e)}
+    else:
+        error = {"status_code": 500, "detail": f"Unexpected error: {str(e)}"}
+    return {"Seller": req.seller_id, "Marketplace": req.marketplace.upper(), "Error": error}
+
+async def analyze_sellers_async(batch: SellerBatchRequest) -> Dict:
+    """Analyze many sellers, sharing Keepa work across them.
+
+    Finder calls run concurrently; the union of ASINs and of categories is fetched once per
+    marketplace; eligibility is then checked per seller. A failing seller only gets an
+    ``Error`` entry in its slot of ``Results``; one cut short by the deadline gets a partial result.
+    """
+    sellers = batch.sellers
+    results: List[Optional[Dict]] = [None] * len(sellers)
+    # Stages each seller skipped for the deadline, and those of the shared per-marketplace lookups
+    skipped: List[List[str]] = [[] for _ in sellers]
+    market_skipped: Dict[str, List[str]] = {}
+
+    def for_seller(i: int, fn, *args):
+        token = skipped_stages.set(skipped[i])
+        try:
+            return fn(*args)
+        finally:
+            skipped_stages.reset(token)
+
+    # 1) ASIN pages for every seller, concurrently
+    async def find(i: int, req: SellerRequest):
+        skipped_stages.set(skipped[i])  # gather runs each call in its own task, so this stays per seller
+        marketplace = _validate_marketplace(req)
+        offset = decode_cursor(req.cursor)
+        asins, has_more = await _fetch_asins_async(req, marketplace, offset, req.page_size)
+        if offset == 0:
+            _raise_if_no_asins(req, asins)
+        return marketplace, offset, asins, encode_cursor(offset + req.page_size) if has_more else None
+
+    found = await asyncio.gather(*(find(i, req) for i, req in enumerate(sellers)), return_exceptions=True)
+    pending = {}
+    for i, (req, outcome) in enumerate(zip(sellers, found)):
+        if isinstance(outcome, DeadlineExceeded):
+            results[i] = for_seller(i, _deadline_response, req, req.marketplace.upper(), decode_cursor(req.cursor), "asin_fetch")
+        elif isinstance(outcome, Exception):
+            results[i] = _batch_error(req, outcome)
+        else:
+            pending[i] = outcome
+
+    # 2) One product query per marketplace for the union of ASINs
+    union: Dict[str, Dict[str, None]] = {}
+    for marketplace, _, asins, _ in pending.values():
+        union.setdefault(marketplace, {}).update(dict.fromkeys(asins))
+    markets = list(union)
+    fetched = await asyncio.gather(
+        *(get_product_details_batch_async(KEEPA_API_KEY, list(union[m]), domain=m) for m in markets),
+        return_exceptions=True,
+    )
+    details = {}
+    for marketplace, outcome in zip(markets, fetched):
+        if isinstance(outcome, (KeepaTokensExhausted, DeadlineExceeded)):
+            details[marketplace] = outcome
+        elif isinstance(outcome, Exception):
+            details[marketplace] = HTTPException(status_code=502, detail=f"Keepa Product Details Error: {str(outcome)}")
+        else:
+            details[marketplace] = {p.asin: p for p in outcome}
+
+    # 3) Strict filter per seller
+    selected = {}
+    for i, (marketplace, offset, asins, _) in pending.items():
+        req = sellers[i]
+        by_asin = details[marketplace]
+        if isinstance(by_asin, DeadlineExceeded):
+            results[i] = for_seller(i, _deadline_response, req, marketplace, offset, "product_details")
+            continue
+        try:
+            if isinstance(by_asin, Exception):
+                raise by_asin
+            products = [by_asin[a] for a in asins if a in by_asin]
+            selected[i] = (_apply_category_filter(req, products) if offset == 0 else _filter_by_category(req, products))
+        except (HTTPException, KeepaTokensExhausted) as e:
+            results[i] = _batch_error(req, e)
+
+    # 4) Categories once per marketplace, alongside one eligibility call per seller
+    category_union: Dict[str, List[int]] = {}
+    for i, final_products in selected.items():
+        category_union.setdefault(pending[i][0], []).extend(_category_ids(final_products))
+    category_markets = list(category_union)
+
+    async def category_names_for(marketplace: str):
+        skipped_stages.set(market_skipped.setdefault(marketplace, []))
+        return await get_category_names_async(KEEPA_API_KEY, category_union[marketplace], domain=marketplace)
+
+    async def eligibility_for(i: int, final_products: List[ProductRecord]):
+        skipped_stages.set(skipped[i])
+        return await check_eligibility_cached_async(sellers[i].seller_id, [p.asin for p in final_products], pending[i][0])
+
+    outcome = await asyncio.gather(
+        asyncio.gather(*(category_names_for(m) for m in category_markets)),
+        asyncio.gather(*(eligibility_for(i, final_products) for i, final_products in selected.items()), return_exceptions=True),
+    )
+    category_names = dict(zip(category_markets, outcome[0]))
+
+    # 5) Format per seller
+    for (i, final_products), eligibility_data in zip(selected.items(), outcome[1]):
+        if isinstance(eligibility_data, Exception):
+            results[i] = _batch_error(sellers[i], eligibility_data)
+            continue
+        marketplace, offset, _, next_cursor = pending[i]
+        skipped[i].extend(name for name in market_skipped.get(marketplace, []) if name not in skipped[i])
+        results[i] = for_seller(i, _format_response, sellers[i], marketplace, final_products, eligibility_data,
+                                category_names.get(marketplace, {}), next_cursor, offset)
+
+    return {
+        "Total_Sellers": len(sellers),
+        "Failed_Sellers": sum(1 for r in results if "Error" in r),
+        "Results": results,
+    }
+
+# --- Response encoding ---
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when it is installed.
+
+    For these payloads (str/int/None/list/dict only) orjson emits exactly the bytes of
+    JSONResponse's compact ``ensure_ascii=False`` encoding, emoji included. Endpoints return
+    it directly, which also skips FastAPI's jsonable_encoder pass over every product.
+    """
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
+
+# --- Stale-while-revalidate response cache ---
+async def _analyze_and_cache(key: tuple, req: SellerRequest, budget_seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Run the analysis and cache it; returns ``(computed_at, result)``."""
+    # Runs in its own task (a refresh outlives the request that started it), so the deadline starts here
+    request_deadline.set(time.monotonic() + budget_seconds)
+    skipped_stages.set([])
+    if ANALYZE_MODE == "sync":
+        result = await run_in_threadpool(analyze_seller_sync, req)
+    else:
+        result = await analyze_seller_async(req)
+    entry = (time.time(), result)
+    # Partial results still go to everyone waiting on this flight, but are never served from cache
+    if RESPONSE_FRESH_SECONDS + RESPONSE_STALE_SECONDS > 0 and not result.get("Partial"):
+        response_cache.set(key, entry)
+    return entry
+
+def _with_data_age(result: Dict, age: float, status: str) -> FastJSONResponse:
+    body = {k: v for k, v in result.items() if k != "Products"}
+    body["Data_Age_Seconds"] = int(age)
+    body["Cache_Status"] = status
+    body["Products"] = result["Products"]
+    return FastJSONResponse(body, headers={"Age": str(int(age))})
+
+# --- Main endpoint with manual filtering ---
+@app.post("/analyze_seller", summary="Analyze seller storefront", response_class=FastJSONResponse)
+async def analyze_seller(req: SellerRequest, x_request_timeout: Optional[float] = Header(None, gt=0)):
+    budget_seconds = min(x_request_timeout or REQUEST_DEADLINE_SECONDS, REQUEST_DEADLINE_SECONDS)
+    request_deadline.set(time.monotonic() + budget_seconds)
+    timer = RequestTimer(req.marketplace.upper(), bool(req.category_id)) if STAGE_TIMING else None
+    request_timer.set(timer)
+    key = (req.seller_id, req.marketplace.upper(), req.category_id, req.page_size, req.cursor)
+    entry = None if req.fresh else response_cache.get(key)
+    if entry is not None:
+        result, age = entry[1], time.time() - entry[0]
+        status = "fresh" if age < RESPONSE_FRESH_SECONDS else "stale"
+        if status == "stale":
+            # Answer from the stale copy now; at most one refresh per key runs behind it
+            flights['analyze_seller'].start_async((*key, REQUEST_DEADLINE_SECONDS), lambda: _analyze_and_cache(key, req))
+    else:
+        # Identical requests arriving while one is running (or refreshing) share its result. Only
+        # requests with the same budget share a flight, so a short X-Request-Timeout never hands
+        # its partial page to callers that allowed more time.
+        flight_key = (*key, budget_seconds)
+        try:
+            computed_at, result = await flights['analyze_seller'].do_async(flight_key, lambda: _analyze_and_cache(key, req, budget_seconds))
+            age, status = max(0.0, time.time() - computed_at), "live"
+        except DeadlineExceeded:
+            # Joined a flight that was still running when this caller's own deadline passed
+            skipped_stages.set([])
+            result, age, status = _deadline_response(req, req.marketplace.upper(), decode_cursor(req.cursor), "asin_fetch"), 0.0, "live"
+
+    set_request_attributes({'seller.id': req.seller_id, 'seller.marketplace': req.marketplace.upper(),
+                            'seller.category_id': req.category_id, 'response.cache_status': status,
+                            'response.products': result.get("Total_Products")})
+    with stage("serialize"):
+        response = _with_data_age(result, age, status)
+    return timer.finish(response) if timer else response
+
+@app.post("/analyze_sellers", summary="Analyze several seller storefronts in one batch", response_class=FastJSONResponse)
+async def analyze_sellers(batch: SellerBatchRequest, x_request_timeout: Optional[float] = Header(None, gt=0)):
+    request_deadline.set(time.monotonic() + min(x_request_timeout or REQUEST_DEADLINE_SECONDS, REQUEST_DEADLINE_SECONDS))
+    return FastJSONResponse(await analyze_sellers_async(batch))
+
+@app.post("/analyze_seller/stream", summary="Stream a full seller storefront as NDJSON")
+async def analyze_seller_stream(req: SellerRequest):
+    """Stream one product record per line as each chunk completes, ending with a summary line.
+
+    Starts at ``cursor`` (if given) and walks the storefront up to STREAM_MAX_PRODUCTS ASINs;
+    ``page_size`` is ignored. Errors after the first record are reported as an ``error`` line.
+    """
+    marketplace = _validate_marketplace(req)
+    offset = decode_cursor(req.cursor)
+    # The first page is fetched up front so "no ASINs" and Keepa failures keep their status codes
+    if ANALYZE_MODE == "sync":
+        asins, has_more = await run_in_threadpool(_fetch_asins_sync, req, marketplace, offset, KEEPA_FINDER_PAGE)
+        _raise_if_no_asins(req, asins)
+        body = stream_seller_sync(req, marketplace, offset, asins, has_more)
+    else:
+        asins, has_more = await _fetch_asins_async(req, marketplace, offset, KEEPA_FINDER_PAGE)
+        _raise_if_no_asins(req, asins)
+        body = stream_seller_async(req, marketplace, offset, asins, has_more)
+    return StreamingResponse(body, media_type="application/x-ndjson")
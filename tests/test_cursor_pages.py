@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+
+@pytest.fixture
+def page_size(monkeypatch):
+    monkeypatch.setattr(main, "KEEPA_FINDER_PAGE", 10)
+    return 10
+
+
+def storefront(n: int, page_size: int) -> list:
+    asins = [f"A{i:03d}" for i in range(n)]
+    return [asins[i:i + page_size] for i in range(0, n, page_size)] or [[]]
+
+
+@pytest.mark.parametrize("offset,limit,pages", [
+    (0, 10, [0]),
+    (0, 11, [0, 1]),
+    (5, 10, [0, 1]),
+    (10, 10, [1]),
+    (19, 2, [1, 2]),
+    (25, 30, [2, 3, 4, 5]),
+])
+def test_finder_pages_cover_the_slice(page_size, offset, limit, pages):
+    assert list(main._finder_pages(offset, limit)) == pages
+
+
+@pytest.mark.parametrize("n,offset,limit,expected,has_more", [
+    (35, 0, 10, (0, 10), True),
+    (35, 5, 10, (5, 15), True),
+    (35, 25, 10, (25, 35), False),
+    (30, 20, 10, (20, 30), True),   # a full last page may have more behind it
+    (28, 20, 10, (20, 28), False),
+    (28, 25, 10, (25, 28), False),
+])
+def test_slice_across_page_boundaries(page_size, n, offset, limit, expected, has_more):
+    pages = storefront(n, page_size)
+    fetched = [pages[p] for p in main._finder_pages(offset, limit) if p < len(pages)]
+    asins, more = main._slice_finder_pages(fetched, offset, limit)
+    assert asins == [f"A{i:03d}" for i in range(*expected)]
+    assert more is has_more
+
+
+def test_pages_continue_where_the_cursor_points(page_size):
+    pages = storefront(47, page_size)
+    seen, offset, more = [], 0, True
+    while more:
+        fetched = [pages[p] for p in main._finder_pages(offset, 7) if p < len(pages)]
+        asins, more = main._slice_finder_pages(fetched, offset, 7)
+        seen += asins
+        offset = main.decode_cursor(main.encode_cursor(offset + 7))
+    assert seen == [f"A{i:03d}" for i in range(47)]
+
+
+def test_decode_cursor():
+    assert main.decode_cursor(None) == 0
+    assert main.decode_cursor("") == 0
+    assert main.decode_cursor(main.encode_cursor(130)) == 130
+
+
+# Not base64, "p:5", "o:-1" and "o:x"
+@pytest.mark.parametrize("cursor", ["not-base64!", "cDo1", "bzotMQ==", "bzp4"])
+def test_decode_cursor_rejects_bad_cursors(cursor):
+    with pytest.raises(HTTPException) as raised:
+        main.decode_cursor(cursor)
+    assert raised.value.status_code == 400
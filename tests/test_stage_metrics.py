@@ -0,0 +1,36 @@
+import os
+import sys
+
+os.environ.setdefault("KEEPA_API_KEY", "x" * 64)
+os.environ.setdefault("OPTISAGE_TOKEN", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def series(body: str, name: str) -> dict:
+    values = {}
+    for line in body.splitlines():
+        if line.startswith(name):
+            key, value = line.rsplit(" ", 1)
+            values[key] = float(value)
+    return values
+
+
+def test_observation_above_top_bucket_keeps_sum_and_count():
+    metrics = main.StageMetrics((0.1, 1.0, 30.0))
+    labels = ("total", "US", False)
+    metrics.observe(labels, 45.0)
+    metrics.observe(labels, 0.3)
+
+    body = metrics.render()
+    sums = series(body, "storefront_stage_duration_seconds_sum")
+    counts = series(body, "storefront_stage_duration_seconds_count")
+    buckets = series(body, "storefront_stage_duration_seconds_bucket")
+    prefix = 'storefront_stage_duration_seconds_bucket{stage="total",marketplace="US",filtered="False"'
+
+    assert list(sums.values()) == [45.3]
+    assert list(counts.values()) == [2]
+    assert buckets[prefix + ',le="1.0"}'] == 1
+    assert buckets[prefix + ',le="30.0"}'] == 1
+    assert buckets[prefix + ',le="+Inf"}'] == 2